@@ -0,0 +1,128 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+from django.contrib.auth import get_user_model
+from django.core.cache import DEFAULT_CACHE_ALIAS, caches
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+from django.db import router
+from rest_framework import exceptions
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.authtoken.models import Token
+
+from .constants import (AUTH_CACHE_SIZE, AUTH_CACHE_TIMEOUT,
+                        AUTH_LOCAL_CACHE_TIMEOUT)
+from recipes.metrics import cache_requests
+
+User = get_user_model()
+
+
+class TokenCache:
+    '''(id, is_active) пользователей по ключу токена.
+
+    Первый уровень - LRU в памяти процесса с коротким временем жизни,
+    второй - кэш Django, если он общий для процессов (LocMemCache
+    и DummyCache не используются: удаление из них не видно другим
+    процессам). При выходе, смене пароля или блокировке записи
+    удаляются из памяти текущего процесса и из общего кэша;
+    в остальных процессах пользователь остаётся в памяти не дольше
+    AUTH_LOCAL_CACHE_TIMEOUT.
+    '''
+
+    def __init__(self, max_size, local_timeout, timeout):
+        self.max_size = max_size
+        self.local_timeout = local_timeout
+        self.timeout = timeout
+        self.local = OrderedDict()
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def get_shared_cache():
+        cache = caches[DEFAULT_CACHE_ALIAS]
+        if isinstance(cache, (LocMemCache, DummyCache)):
+            return None
+        return cache
+
+    @staticmethod
+    def get_cache_key(key):
+        return f'auth:{hashlib.sha256(key.encode()).hexdigest()}'
+
+    def get(self, key):
+        entry = self.get_local(key)
+        if entry is not None:
+            cache_requests.inc(cache='auth_token', result='local_hit')
+            return entry
+        cache = self.get_shared_cache()
+        entry = cache and cache.get(self.get_cache_key(key))
+        if entry is not None:
+            cache_requests.inc(cache='auth_token', result='hit')
+            self.set_local(key, entry)
+        else:
+            cache_requests.inc(cache='auth_token', result='miss')
+        return entry
+
+    def get_local(self, key):
+        with self.lock:
+            entry = self.local.get(key)
+            if entry is None or entry[0] <= time.monotonic():
+                self.local.pop(key, None)
+                return None
+            self.local.move_to_end(key)
+            return entry[1]
+
+    def set(self, key, user):
+        entry = (user.pk, user.is_active)
+        cache = self.get_shared_cache()
+        if cache:
+            cache.set(self.get_cache_key(key), entry, self.timeout)
+        self.set_local(key, entry)
+
+    def set_local(self, key, entry):
+        with self.lock:
+            self.local[key] = (time.monotonic() + self.local_timeout, entry)
+            self.local.move_to_end(key)
+            while len(self.local) > self.max_size:
+                self.local.popitem(last=False)
+
+    def delete(self, *keys):
+        with self.lock:
+            for key in keys:
+                self.local.pop(key, None)
+        cache = self.get_shared_cache()
+        if cache:
+            cache.delete_many([self.get_cache_key(key) for key in keys])
+
+
+token_cache = TokenCache(
+    AUTH_CACHE_SIZE, AUTH_LOCAL_CACHE_TIMEOUT, AUTH_CACHE_TIMEOUT)
+
+
+def get_deferred_user(user_id, is_active):
+    '''Пользователь без запроса к базе: остальные поля отложены.
+
+    Кэшируются только id и активность, без хэша пароля и счётчиков;
+    поля профиля загружаются при первом обращении (см. User.
+    refresh_from_db), а save() такого объекта пишет только загруженные
+    поля.
+    '''
+    return User.from_db(router.db_for_read(User), ['id', 'is_active'],
+                        [user_id, is_active])
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    '''TokenAuthentication без запроса к базе для известных токенов.'''
+
+    def authenticate_credentials(self, key):
+        entry = token_cache.get(key)
+        if entry is None:
+            user, token = super().authenticate_credentials(key)
+            token_cache.set(key, user)
+            return user, token
+        user = get_deferred_user(*entry)
+        if not user.is_active:
+            raise exceptions.AuthenticationFailed(
+                'User inactive or deleted.')
+        token = Token(key=key, user=user)
+        return user, token
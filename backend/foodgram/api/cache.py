@@ -0,0 +1,115 @@
+import hashlib
+
+from django.core.cache import cache
+from django.db.models import prefetch_related_objects
+from django.http import HttpResponse
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date
+from rest_framework.renderers import JSONRenderer
+
+from .constants import CATALOG_CACHE_TIMEOUT, RECIPE_CACHE_TIMEOUT
+from recipes.metrics import cache_requests
+from recipes.models import Ingredient, RecipeQuerySet, Tag
+from recipes.versions import get_model_version, get_model_versions
+
+
+class CatalogCacheMixin:
+    '''Кэш готовых JSON-ответов для справочников (теги, ингредиенты).
+
+    Ключ кэша и ETag строятся по версии данных модели, которая меняется
+    при каждом сохранении или удалении записи (см. recipes.signals) и
+    хранится в базе, поэтому одинакова во всех процессах и сброс кэша
+    не требуется. На If-None-Match и If-Modified-Since
+    отвечаем 304 без обращения к базе.
+    '''
+
+    def list(self, request, *args, **kwargs):
+        return self.get_cached_response(
+            super().list, request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.get_cached_response(
+            super().retrieve, request, *args, **kwargs)
+
+    def get_cached_response(self, handler, request, *args, **kwargs):
+        if request.accepted_renderer.format != 'json':
+            return handler(request, *args, **kwargs)
+        version = get_model_version(self.queryset.model)
+        digest = hashlib.md5(
+            f'{version}:{request.get_full_path()}'.encode()).hexdigest()
+        etag = f'"{digest}"'
+        last_modified = version // 10 ** 9
+        response = get_conditional_response(
+            request, etag=etag, last_modified=last_modified)
+        if response is not None:
+            cache_requests.inc(cache='catalog', result='not_modified')
+        else:
+            key = f'catalog:{digest}'
+            content = cache.get(key)
+            cache_requests.inc(
+                cache='catalog', result='miss' if content is None else 'hit')
+            if content is None:
+                response = handler(request, *args, **kwargs)
+                if response.status_code != 200:
+                    return response
+                content = JSONRenderer().render(response.data)
+                cache.set(key, content, CATALOG_CACHE_TIMEOUT)
+            response = HttpResponse(
+                content, content_type='application/json')
+        response['ETag'] = etag
+        response['Last-Modified'] = http_date(last_modified)
+        patch_cache_control(response, no_cache=True)
+        return response
+
+
+def get_fragment_keys(recipes, request):
+    '''Ключи кэша представлений рецептов.
+
+    Кроме версии рецепта в ключ входят версии тегов и ингредиентов
+    (их переименование меняет вложенные данные) и адрес сайта, от которого
+    зависят абсолютные ссылки на картинки.
+    '''
+    site = request.build_absolute_uri('/') if request else ''
+    tag_version, ingredient_version = get_model_versions(Tag, Ingredient)
+    digest = hashlib.md5(
+        f'{tag_version}:{ingredient_version}:{site}'.encode()).hexdigest()
+    return {recipe.pk: f'recipe:{recipe.pk}:{recipe.version}:{digest}'
+            for recipe in recipes}
+
+
+def apply_user_flags(data, recipe):
+    '''наложить флаги текущего пользователя на общее представление'''
+    data = dict(data)
+    data['author'] = dict(data['author'],
+                          is_subscribed=recipe.author_is_subscribed)
+    data['is_favorited'] = recipe.is_favorited
+    data['is_in_shopping_cart'] = recipe.is_in_shopping_cart
+    return data
+
+
+def render_recipes(serializer, recipes):
+    '''Представления рецептов через кэш фрагментов.
+
+    В кэше хранится не зависящая от пользователя часть ответа. Связанные
+    объекты загружаются только для промахов, флаги пользователя берутся
+    из аннотаций RecipeQuerySet.with_user_flags. Рецепты без аннотаций
+    сериализуются без кэша.
+    '''
+    if not all(hasattr(recipe, 'is_favorited') for recipe in recipes):
+        return [serializer.render(recipe) for recipe in recipes]
+    keys = get_fragment_keys(recipes, serializer.context.get('request'))
+    fragments = cache.get_many(keys.values())
+    misses = [recipe for recipe in recipes if keys[recipe.pk] not in fragments]
+    if len(misses) < len(recipes):
+        cache_requests.inc(len(recipes) - len(misses),
+                           cache='recipe', result='hit')
+    if misses:
+        cache_requests.inc(len(misses), cache='recipe', result='miss')
+        prefetch_related_objects(
+            misses, 'author', *RecipeQuerySet.get_relations())
+        rendered = {keys[recipe.pk]: serializer.render(recipe)
+                    for recipe in misses}
+        cache.set_many(rendered, RECIPE_CACHE_TIMEOUT)
+        fragments.update(rendered)
+    return [apply_user_flags(fragments[keys[recipe.pk]], recipe)
+            for recipe in recipes]
@@ -1,5 +1,26 @@
 # Default number of recipes for author in subscriptions list view.
 RECIPES_LIMIT = 3
 
+# Max number of recipes for author in subscriptions list view.
+MAX_RECIPES_LIMIT = 10
+
 # Default page size for paginator.
 PAGE_SIZE = 10
+
+# Lifetime of cached catalog responses (tags, ingredients) in seconds.
+CATALOG_CACHE_TIMEOUT = 60 * 60 * 24
+
+# Lifetime of cached recipe representations in seconds.
+RECIPE_CACHE_TIMEOUT = 60 * 60 * 24
+
+# Max number of recipes in one batch favorites/shopping cart request.
+BATCH_LIMIT = 100
+
+# Cached token authentication: max users kept in process memory, lifetime
+# of in-process entries and of entries in the shared cache in seconds.
+# The shared tier is skipped with process-local cache backends (LocMem,
+# Dummy), so a revoked token works on other processes for at most
+# AUTH_LOCAL_CACHE_TIMEOUT.
+AUTH_CACHE_SIZE = 10000
+AUTH_LOCAL_CACHE_TIMEOUT = 30
+AUTH_CACHE_TIMEOUT = 60 * 5
@@ -1,4 +1,15 @@
-from rest_framework.pagination import PageNumberPagination
+import base64
+import binascii
+import json
+from functools import reduce
+from operator import attrgetter, or_
+
+from django.core.exceptions import FieldDoesNotExist, ValidationError
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination, PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
 
 from .constants import PAGE_SIZE
 
@@ -7,3 +18,166 @@ class CustomPageNumberPagination(PageNumberPagination):
     page_size = PAGE_SIZE
     page_query_param = 'page'
     page_size_query_param = 'limit'
+
+
+class KeysetPagination(BasePagination):
+    '''Пагинация по ключу сортировки без COUNT и OFFSET.
+
+    Сортировка берётся из cursor_ordering представления, последнее поле
+    должно быть уникальным (обычно id). Курсор хранит значения ключа
+    крайней записи страницы и направление обхода.
+    '''
+    cursor_query_param = 'cursor'
+    page_size = PAGE_SIZE
+    page_size_query_param = 'limit'
+    ordering = ('-pub_date', '-id')
+    invalid_cursor_message = 'Неверный курсор.'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.ordering = getattr(view, 'cursor_ordering', self.ordering)
+        self.page_size = self.get_page_size(request)
+        values, reverse = self.decode_cursor(request)
+        if values is not None:
+            values = self.convert_values(queryset.model, values)
+        ordering = self.ordering
+        if reverse:
+            ordering = [self.flip(field) for field in ordering]
+        queryset = queryset.order_by(*ordering)
+        if values is not None:
+            queryset = queryset.filter(self.get_keyset_filter(
+                ordering, values))
+        results = list(queryset[:self.page_size + 1])
+        has_more = len(results) > self.page_size
+        results = results[:self.page_size]
+        if reverse:
+            results.reverse()
+            has_next, has_previous = True, has_more
+        else:
+            has_next, has_previous = has_more, values is not None
+        self.next_values = (
+            self.get_key(results[-1]) if has_next and results else None)
+        self.previous_values = (
+            self.get_key(results[0]) if has_previous and results else None)
+        return results
+
+    def get_paginated_response(self, data):
+        return Response({
+            'next': self.get_link(self.next_values, reverse=False),
+            'previous': self.get_link(self.previous_values, reverse=True),
+            'results': data,
+        })
+
+    def get_page_size(self, request):
+        try:
+            page_size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        return page_size if page_size > 0 else self.page_size
+
+    @staticmethod
+    def flip(field):
+        return field[1:] if field.startswith('-') else f'-{field}'
+
+    def get_key(self, instance):
+        return [
+            attrgetter(field.lstrip('-').replace('__', '.'))(instance)
+            for field in self.ordering
+        ]
+
+    @staticmethod
+    def get_keyset_filter(ordering, values):
+        '''Условие "строго после ключа values" для сортировки ordering.
+
+        Первое поле дополнительно ограничено нестрогим сравнением, чтобы
+        база могла использовать индекс по ключу сортировки.
+        '''
+        lookups = []
+        for position, field in enumerate(ordering):
+            name = field.lstrip('-')
+            operator = 'lt' if field.startswith('-') else 'gt'
+            equal = {
+                previous.lstrip('-'): value for previous, value in zip(
+                    ordering[:position], values)
+            }
+            lookups.append(Q(**equal, **{f'{name}__{operator}':
+                                         values[position]}))
+        first = ordering[0]
+        operator = 'lte' if first.startswith('-') else 'gte'
+        bound = Q(**{f'{first.lstrip("-")}__{operator}': values[0]})
+        return bound & reduce(or_, lookups)
+
+    def get_link(self, values, reverse):
+        if values is None:
+            return None
+        cursor = base64.urlsafe_b64encode(json.dumps(
+            {'v': values, 'r': reverse}, default=self.encode_value,
+        ).encode()).decode()
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.cursor_query_param, cursor)
+
+    @staticmethod
+    def encode_value(value):
+        # isoformat сохраняет микросекунды, без них ключ неоднозначен.
+        if hasattr(value, 'isoformat'):
+            return value.isoformat()
+        return str(value)
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None, False
+        try:
+            cursor = json.loads(base64.urlsafe_b64decode(encoded.encode()))
+            values, reverse = cursor['v'], bool(cursor['r'])
+        except (binascii.Error, ValueError, KeyError, TypeError):
+            raise NotFound(self.invalid_cursor_message)
+        if not isinstance(values, list) or len(values) != len(self.ordering):
+            raise NotFound(self.invalid_cursor_message)
+        return values, reverse
+
+    def convert_values(self, model, values):
+        '''Привести значения курсора к типам полей сортировки.
+
+        Курсор приходит от клиента: неподходящее значение даёт NotFound,
+        а не ошибку базы или сравнения.
+        '''
+        try:
+            return [self.convert_value(model, field.lstrip('-'), value)
+                    for field, value in zip(self.ordering, values)]
+        except (ValidationError, TypeError, ValueError):
+            raise NotFound(self.invalid_cursor_message)
+
+    @staticmethod
+    def convert_value(model, path, value):
+        '''значение для поля path (через __), для аннотаций - скаляр JSON'''
+        try:
+            *relations, name = path.split('__')
+            for relation in relations:
+                model = model._meta.get_field(relation).related_model
+            field = model._meta.get_field(name)
+        except (FieldDoesNotExist, AttributeError):
+            if isinstance(value, (dict, list)):
+                raise TypeError(f'{path}: scalar expected')
+            return value
+        return field.to_python(value)
+
+
+class OptionalKeysetPagination(CustomPageNumberPagination):
+    '''page/limit по умолчанию, курсорная пагинация при наличии ?cursor=.
+
+    Первая страница в курсорном режиме запрашивается с пустым cursor.
+    '''
+    keyset_class = KeysetPagination
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.keyset = None
+        if self.keyset_class.cursor_query_param in request.query_params:
+            self.keyset = self.keyset_class()
+            return self.keyset.paginate_queryset(queryset, request, view)
+        return super().paginate_queryset(queryset, request, view)
+
+    def get_paginated_response(self, data):
+        if self.keyset is not None:
+            return self.keyset.get_paginated_response(data)
+        return super().get_paginated_response(data)
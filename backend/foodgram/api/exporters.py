@@ -0,0 +1,158 @@
+import csv
+from itertools import islice
+
+from recipes.metrics import export_duration
+from recipes.utils import transliterate
+
+
+class ShoppingListExporter:
+    '''Потоковая выгрузка списка покупок.
+
+    Строки читаются из базы итератором (серверным курсором на PostgreSQL)
+    и сразу отдаются клиенту, весь файл в памяти не собирается.
+    '''
+    extension = None
+    content_type = None
+    chunk_size = 2000
+
+    def __init__(self, user, items):
+        self.user = user
+        self.items = items
+
+    @property
+    def filename(self):
+        return f'{self.user.username}_shopping_list.{self.extension}'
+
+    def rows(self):
+        for name, measurement_unit, amount in self.items.values_list(
+                'ingredient__name', 'ingredient__measurement_unit',
+                'amount').iterator(chunk_size=self.chunk_size):
+            yield name.capitalize(), measurement_unit, amount
+
+    def stream(self):
+        raise NotImplementedError
+
+    def timed_stream(self):
+        with export_duration.time(format=self.extension):
+            yield from self.stream()
+
+
+class TextExporter(ShoppingListExporter):
+    extension = 'txt'
+    content_type = 'text/plain; charset=utf-8'
+
+    def stream(self):
+        yield f'Список покупок для:\n\n{self.user.first_name}\n'.encode()
+        for name, measurement_unit, amount in self.rows():
+            yield f'\n{name} ({measurement_unit}) - {amount}\n'.encode()
+
+
+class _Echo:
+    def write(self, value):
+        return value
+
+
+class CSVExporter(ShoppingListExporter):
+    extension = 'csv'
+    content_type = 'text/csv; charset=utf-8'
+
+    def stream(self):
+        writer = csv.writer(_Echo())
+        # BOM, чтобы Excel правильно открывал кириллицу.
+        yield '\ufeff'.encode()
+        yield writer.writerow(
+            ('Ингредиент', 'Единица измерения', 'Количество')).encode()
+        for row in self.rows():
+            yield writer.writerow(row).encode()
+
+
+class PDFExporter(ShoppingListExporter):
+    '''Минимальный PDF без внешних зависимостей.
+
+    Используется встроенный шрифт Helvetica, в котором нет кириллицы,
+    поэтому текст транслитерируется. Страницы формируются и отдаются
+    по одной.
+    '''
+    extension = 'pdf'
+    content_type = 'application/pdf'
+    lines_per_page = 50
+    font_size = 11
+    leading = 15
+
+    def stream(self):
+        self._offsets = {}
+        self._position = 0
+        yield self._write(b'%PDF-1.4\n')
+        yield self._object(
+            3, b'<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica '
+               b'/Encoding /WinAnsiEncoding >>')
+        page_ids = []
+        for lines in self._pages():
+            content_id = 4 + 2 * len(page_ids)
+            content = self._page_content(lines)
+            yield self._object(
+                content_id,
+                b'<< /Length %d >>\nstream\n%s\nendstream'
+                % (len(content), content))
+            yield self._object(
+                content_id + 1,
+                b'<< /Type /Page /Parent 2 0 R /MediaBox [0 0 595 842] '
+                b'/Resources << /Font << /F1 3 0 R >> >> '
+                b'/Contents %d 0 R >>' % content_id)
+            page_ids.append(content_id + 1)
+        kids = b' '.join(b'%d 0 R' % page_id for page_id in page_ids)
+        yield self._object(
+            2, b'<< /Type /Pages /Kids [%s] /Count %d >>'
+               % (kids, len(page_ids)))
+        yield self._object(1, b'<< /Type /Catalog /Pages 2 0 R >>')
+        yield self._xref()
+
+    def _lines(self):
+        yield f'Spisok pokupok dlya: {transliterate(self.user.first_name)}'
+        yield ''
+        for name, measurement_unit, amount in self.rows():
+            yield (f'{transliterate(name)} '
+                   f'({transliterate(measurement_unit)}) - {amount}')
+
+    def _pages(self):
+        lines = self._lines()
+        page = list(islice(lines, self.lines_per_page))
+        while page:
+            yield page
+            page = list(islice(lines, self.lines_per_page))
+
+    def _page_content(self, lines):
+        content = [b'BT /F1 %d Tf %d TL 50 800 Td'
+                   % (self.font_size, self.leading)]
+        for line in lines:
+            text = line.encode('cp1252', errors='replace')
+            text = (text.replace(b'\\', b'\\\\')
+                    .replace(b'(', b'\\(').replace(b')', b'\\)'))
+            content.append(b'(%s) Tj T*' % text)
+        content.append(b'ET')
+        return b'\n'.join(content)
+
+    def _write(self, data):
+        self._position += len(data)
+        return data
+
+    def _object(self, object_id, body):
+        self._offsets[object_id] = self._position
+        return self._write(b'%d 0 obj\n%s\nendobj\n' % (object_id, body))
+
+    def _xref(self):
+        size = max(self._offsets) + 1
+        entries = [b'xref\n0 %d\n0000000000 65535 f \n' % size]
+        entries.extend(
+            b'%010d 00000 n \n' % self._offsets[object_id]
+            for object_id in range(1, size))
+        entries.append(
+            b'trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n'
+            % (size, self._position))
+        return b''.join(entries)
+
+
+EXPORTERS = {
+    exporter.extension: exporter
+    for exporter in (TextExporter, CSVExporter, PDFExporter)
+}
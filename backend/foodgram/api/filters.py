@@ -1,7 +1,8 @@
-from django.db.models import Q
+from django.db.models import Exists, OuterRef
 from django_filters import rest_framework as filters
 
-from recipes.models import Ingredient, Recipe, Tag
+from recipes.models import Recipe, Tag
+from recipes.search import search_recipes
 from users.models import User
 
 
@@ -14,34 +15,42 @@ class RecipeFilter(filters.FilterSet):
         field_name='tags__slug',
         to_field_name='slug',
         queryset=Tag.objects.all(),
+        method='tags_method',
     )
     author = filters.ModelChoiceFilter(queryset=User.objects)
     is_favorited = filters.BooleanFilter(method='is_favorited_method')
     is_in_shopping_cart = filters.BooleanFilter(
         method='is_in_shopping_cart_method')
+    search = filters.CharFilter(method='search_method')
 
     class Meta:
         model = Recipe
-        fields = ['name', 'author', 'is_favorited', 'is_in_shopping_cart']
+        fields = ['name', 'author', 'is_favorited', 'is_in_shopping_cart',
+                  'search']
+
+    def tags_method(self, queryset, name, value):
+        if not value:
+            return queryset
+        return queryset.filter(Exists(Recipe.tags.through.objects.filter(
+            recipe=OuterRef('pk'), tag__in=value)))
+
+    def user_relation_filter(self, queryset, through, value):
+        '''EXISTS / NOT EXISTS по m2m-таблице вместо отрицания джойна'''
+        if value is None:
+            return queryset
+        if not self.user.is_authenticated:
+            return queryset.none() if value else queryset
+        relation = Exists(through.objects.filter(
+            user=self.user, recipe=OuterRef('pk')))
+        return queryset.filter(relation if value else ~relation)
 
     def is_favorited_method(self, queryset, name, value):
-        if value is True:
-            return queryset.filter(favorited=self.user)
-        if value is False:
-            return queryset.filter(~Q(favorited=self.user))
-        return None
+        return self.user_relation_filter(
+            queryset, User.favorites.through, value)
 
     def is_in_shopping_cart_method(self, queryset, name, value):
-        if value is True:
-            return queryset.filter(shopped=self.user)
-        if value is False:
-            return queryset.filter(~Q(shopped=self.user))
-        return None
+        return self.user_relation_filter(
+            queryset, User.shopping_cart.through, value)
 
-
-class InrgedientFilter(filters.FilterSet):
-    name = filters.CharFilter(field_name='name', lookup_expr='istartswith')
-
-    class Meta:
-        model = Ingredient
-        fields = ['name']
+    def search_method(self, queryset, name, value):
+        return search_recipes(queryset, value)
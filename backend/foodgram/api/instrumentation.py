@@ -0,0 +1,161 @@
+import logging
+import random
+import re
+import time
+from collections import Counter, defaultdict
+from contextlib import ExitStack, contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db import connections
+
+from recipes.metrics import db_queries, request_duration, request_queries
+
+logger = logging.getLogger(__name__)
+
+current_metrics = ContextVar('current_metrics', default=None)
+
+SQL_NUMBER = re.compile(r'\b\d+\b')
+SQL_PARAMS_LIST = re.compile(r'\(%s(?:, %s)*\)')
+SQL_STRING = re.compile(r"'(?:[^']|'')*'")
+
+
+def get_fingerprint(sql):
+    '''SQL без значений: одинаковые запросы с разными параметрами
+    и разной длиной IN-списков дают один отпечаток'''
+    sql = SQL_PARAMS_LIST.sub('(...)', sql)
+    sql = SQL_STRING.sub('?', sql)
+    return SQL_NUMBER.sub('?', sql)
+
+
+class RequestMetrics:
+    '''Число и время SQL-запросов и именованные интервалы одного запроса.'''
+
+    def __init__(self):
+        self.queries = 0
+        self.db_time = 0.0
+        self.timings = defaultdict(float)
+        self.fingerprints = Counter()
+        self.running = set()
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.db_time += time.perf_counter() - start
+            self.queries += 1
+            self.fingerprints[get_fingerprint(sql)] += 1
+
+
+@contextmanager
+def timer(name):
+    '''Добавить время блока к интервалу name текущего запроса.
+
+    Вложенные блоки с тем же именем не учитываются повторно. Вне
+    измеряемого запроса ничего не делает.
+    '''
+    metrics = current_metrics.get()
+    if metrics is None or name in metrics.running:
+        yield
+        return
+    metrics.running.add(name)
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        metrics.timings[name] += time.perf_counter() - start
+        metrics.running.discard(name)
+
+
+class TimedSerializerMixin:
+    '''Время сериализации попадает в интервал serializer.'''
+
+    def to_representation(self, instance):
+        with timer('serializer'):
+            return super().to_representation(instance)
+
+
+def get_view_name(request):
+    '''ViewSet.action для DRF, имя маршрута для остальных представлений'''
+    match = request.resolver_match
+    if match is None:
+        return 'unresolved'
+    view_class = getattr(match.func, 'cls', None)
+    if view_class is None:
+        return match.view_name or match.func.__name__
+    actions = getattr(match.func, 'actions', None) or {}
+    action = actions.get(request.method.lower(), request.method.lower())
+    return f'{view_class.__name__}.{action}'
+
+
+class InstrumentationMiddleware:
+    '''Число SQL-запросов, время базы, сериализации и всего запроса.
+
+    Длительность каждого запроса попадает в гистограмму
+    foodgram_http_request_duration_seconds. Для доли запросов
+    INSTRUMENTATION['SAMPLE_RATE'] дополнительно считаются SQL-запросы:
+    результаты отдаются в заголовке Server-Timing, а медленные запросы
+    (дольше SLOW_REQUEST_MS) пишутся в лог с самыми частыми SQL.
+    Остальные запросы обрабатываются без обёрток.
+    '''
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        options = settings.INSTRUMENTATION
+        self.sample_rate = options['SAMPLE_RATE']
+        self.slow_request = options['SLOW_REQUEST_MS'] / 1000
+        self.server_timing = options['SERVER_TIMING']
+        self.top_queries = options['TOP_QUERIES']
+
+    def __call__(self, request):
+        start = time.perf_counter()
+        if random.random() >= self.sample_rate:
+            response = self.get_response(request)
+            request_duration.observe(
+                time.perf_counter() - start,
+                view=get_view_name(request), method=request.method)
+            return response
+        metrics = RequestMetrics()
+        token = current_metrics.set(metrics)
+        try:
+            with ExitStack() as stack:
+                for connection in connections.all():
+                    stack.enter_context(connection.execute_wrapper(metrics))
+                response = self.get_response(request)
+        finally:
+            current_metrics.reset(token)
+        total = time.perf_counter() - start
+        self.record(request, response, metrics, total)
+        return response
+
+    def record(self, request, response, metrics, total):
+        view = get_view_name(request)
+        request_duration.observe(total, view=view, method=request.method)
+        request_queries.observe(metrics.queries, view=view)
+        if metrics.queries:
+            db_queries.inc(metrics.queries, view=view)
+        if self.server_timing:
+            response['Server-Timing'] = self.get_server_timing(
+                view, metrics, total)
+        if total >= self.slow_request:
+            top = '\n'.join(
+                f'  {count} x {sql}'
+                for sql, count in metrics.fingerprints.most_common(
+                    self.top_queries))
+            logger.warning(
+                'Slow request %s %s (%s): %.0f ms, %d queries, '
+                'db %.0f ms, serializer %.0f ms\n%s',
+                request.method, request.path, view, total * 1000,
+                metrics.queries, metrics.db_time * 1000,
+                metrics.timings['serializer'] * 1000, top)
+
+    def get_server_timing(self, view, metrics, total):
+        entries = [
+            f'db;dur={metrics.db_time * 1000:.1f};'
+            f'desc="{metrics.queries} queries"',
+            *(f'{name};dur={duration * 1000:.1f}'
+              for name, duration in metrics.timings.items()),
+            f'total;dur={total * 1000:.1f};desc="{view}"',
+        ]
+        return ', '.join(entries)
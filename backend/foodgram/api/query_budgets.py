@@ -0,0 +1,99 @@
+from collections import namedtuple
+
+QueryBudget = namedtuple(
+    'QueryBudget', ('name', 'method', 'path', 'max_queries', 'data'),
+    defaults=(None,))
+
+
+def recipe_payload(context):
+    return {
+        'name': 'Рецепт для проверки',
+        'text': 'Описание',
+        'cooking_time': 10,
+        'image': context['image'],
+        'tags': context['tag_ids'],
+        'ingredients': [{'id': pk, 'amount': 10}
+                        for pk in context['ingredient_ids']],
+    }
+
+
+def recipe_update_payload(context):
+    return {**recipe_payload(context), 'name': 'Изменённый рецепт'}
+
+
+def recipe_ids_payload(context):
+    return {'recipes': context['recipe_ids']}
+
+
+def remove_ingredients_payload(context):
+    # the seeded recipe has several ingredients, all but one are removed
+    return {'ingredients': [{'id': context['ingredient_ids'][0],
+                             'amount': 5}]}
+
+
+def password_payload(context):
+    return {'current_password': context['password']}
+
+
+# Max number of SQL queries per API request. Checked by
+# api/tests/test_query_budgets.py on seeded data of several sizes: a request
+# fails if it exceeds its budget or issues more queries on larger data.
+# Paths are formatted with ids of seeded objects (see seeding.get_context).
+# Requests run in this order on the same data, deletions come last.
+QUERY_BUDGETS = (
+    QueryBudget('recipes list', 'get', '/api/recipes/?limit=6', 6),
+    QueryBudget('recipes list, page of 50', 'get',
+                '/api/recipes/?limit=50', 6),
+    QueryBudget('recipes list, favorited', 'get',
+                '/api/recipes/?is_favorited=1', 6),
+    QueryBudget('recipes list, in shopping cart', 'get',
+                '/api/recipes/?is_in_shopping_cart=1', 6),
+    QueryBudget('recipes list, by tag', 'get',
+                '/api/recipes/?tags={tag}', 7),
+    QueryBudget('recipes list, by author', 'get',
+                '/api/recipes/?author={author}', 7),
+    QueryBudget('recipes list, search', 'get',
+                '/api/recipes/?search=рецепт', 6),
+    QueryBudget('recipe detail', 'get', '/api/recipes/{recipe}/', 5),
+    QueryBudget('recipe create', 'post', '/api/recipes/', 17,
+                recipe_payload),
+    QueryBudget('favorite add', 'post', '/api/recipes/{recipe}/favorite/', 4),
+    QueryBudget('favorite remove', 'delete',
+                '/api/recipes/{recipe}/favorite/', 4),
+    QueryBudget('shopping cart add', 'post',
+                '/api/recipes/{recipe}/shopping_cart/', 9),
+    QueryBudget('shopping cart remove', 'delete',
+                '/api/recipes/{recipe}/shopping_cart/', 9),
+    QueryBudget('download shopping cart, txt', 'get',
+                '/api/recipes/download_shopping_cart/?format=txt', 1),
+    QueryBudget('download shopping cart, csv', 'get',
+                '/api/recipes/download_shopping_cart/?format=csv', 1),
+    QueryBudget('download shopping cart, pdf', 'get',
+                '/api/recipes/download_shopping_cart/?format=pdf', 1),
+    QueryBudget('subscriptions', 'get',
+                '/api/users/subscriptions/?limit=6&recipes_limit=3', 3),
+    QueryBudget('subscribe', 'post', '/api/users/{author}/subscribe/', 5),
+    QueryBudget('unsubscribe', 'delete', '/api/users/{author}/subscribe/', 4),
+    QueryBudget('users list', 'get', '/api/users/?limit=6', 2),
+    QueryBudget('current user', 'get', '/api/users/me/', 1),
+    QueryBudget('ingredients list', 'get', '/api/ingredients/', 2),
+    QueryBudget('ingredients search', 'get',
+                '/api/ingredients/?name=ингр', 2),
+    QueryBudget('tags list', 'get', '/api/tags/', 2),
+    QueryBudget('favorite batch add', 'post', '/api/recipes/favorite/', 5,
+                recipe_ids_payload),
+    QueryBudget('favorite batch remove', 'delete', '/api/recipes/favorite/',
+                5, recipe_ids_payload),
+    QueryBudget('shopping cart batch add', 'post',
+                '/api/recipes/shopping_cart/', 10, recipe_ids_payload),
+    QueryBudget('shopping cart batch remove', 'delete',
+                '/api/recipes/shopping_cart/', 10, recipe_ids_payload),
+    QueryBudget('recipe update, remove ingredients', 'patch',
+                '/api/recipes/{own_recipe}/', 21,
+                remove_ingredients_payload),
+    QueryBudget('recipe update', 'put', '/api/recipes/{own_recipe}/', 26,
+                recipe_update_payload),
+    QueryBudget('recipe delete', 'delete', '/api/recipes/{own_recipe}/', 17),
+    QueryBudget('user delete', 'delete', '/api/users/me/', 32,
+                password_payload),
+)
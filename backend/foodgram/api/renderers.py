@@ -0,0 +1,27 @@
+from rest_framework.renderers import BaseRenderer, JSONRenderer
+
+
+class ExportRenderer(BaseRenderer):
+    '''Рендерер для выбора формата выгрузки через ?format= или Accept.
+
+    Сами выгрузки отдаются потоком в обход рендерера, через него проходят
+    только ответы с ошибками, которые сериализуются в JSON.
+    '''
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        return JSONRenderer().render(data)
+
+
+class TextRenderer(ExportRenderer):
+    media_type = 'text/plain'
+    format = 'txt'
+
+
+class CSVRenderer(ExportRenderer):
+    media_type = 'text/csv'
+    format = 'csv'
+
+
+class PDFRenderer(ExportRenderer):
+    media_type = 'application/pdf'
+    format = 'pdf'
@@ -1,18 +1,30 @@
 import base64
 
+from django.core.exceptions import ValidationError as DjangoValidationError
 from django.core.files.base import ContentFile
+from django.db import transaction
+from django.db.models import Manager
+from PIL import Image
 from rest_framework import serializers
 from rest_framework.validators import UniqueTogetherValidator, UniqueValidator
 
-from .constants import RECIPES_LIMIT
-from recipes.models import Ingredient, IngredientAmount, Recipe, Tag
+from .cache import render_recipes
+from .constants import BATCH_LIMIT
+from .instrumentation import TimedSerializerMixin, timer
+from recipes import images, shopping_list, tasks
+from recipes.metrics import image_decode_duration
+from recipes.models import (ImageStatus, Ingredient, IngredientAmount, Recipe,
+                            Tag)
+from recipes.signals import amounts_handled
 from users.models import Subscription, User
 
 
-class UserSerializer(serializers.ModelSerializer):
+class UserSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     is_subscribed = serializers.SerializerMethodField()
 
     def get_is_subscribed(self, obj):
+        if hasattr(obj, 'is_subscribed'):
+            return obj.is_subscribed
         if self.context['request'].user.is_authenticated:
             current_user = self.context['request'].user
             return Subscription.objects.filter(
@@ -31,7 +43,7 @@ class UserSerializer(serializers.ModelSerializer):
         )
 
 
-class TagSerializer(serializers.ModelSerializer):
+class TagSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     name = serializers.CharField(
         max_length=250,
         validators=[UniqueValidator(
@@ -50,7 +62,7 @@ class TagSerializer(serializers.ModelSerializer):
         )
 
 
-class IngredientSerializer(serializers.ModelSerializer):
+class IngredientSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     class Meta:
         model = Ingredient
         fields = (
@@ -82,9 +94,31 @@ class IngredientAmountSerializer(serializers.ModelSerializer):
         ]
 
 
+class BulkPrimaryKeyRelatedField(serializers.PrimaryKeyRelatedField):
+    '''Первичный ключ, который проверяется только на тип.
+
+    Объекты загружаются родительским сериализатором одним запросом
+    на весь список через get_objects.
+    '''
+
+    def to_internal_value(self, data):
+        if isinstance(data, bool):
+            self.fail('incorrect_type', data_type=type(data).__name__)
+        try:
+            return self.get_queryset().model._meta.pk.to_python(data)
+        except (TypeError, ValueError, DjangoValidationError):
+            self.fail('incorrect_type', data_type=type(data).__name__)
+
+    def get_objects(self, pks):
+        return self.get_queryset().in_bulk(pks)
+
+    def does_not_exist(self, pk):
+        return self.error_messages['does_not_exist'].format(pk_value=pk)
+
+
 class IngredientAmountCreateSerializer(serializers.ModelSerializer):
-    id = serializers.PrimaryKeyRelatedField(queryset=Ingredient.objects,
-                                            source='ingredient')
+    id = BulkPrimaryKeyRelatedField(queryset=Ingredient.objects,
+                                    source='ingredient')
     amount = serializers.IntegerField(write_only=True)
 
     class Meta:
@@ -95,13 +129,58 @@ class IngredientAmountCreateSerializer(serializers.ModelSerializer):
         )
 
 
-class Base64ImageField(serializers.ImageField):
+class Base64ImageField(serializers.FileField):
+    '''Картинка в base64 или файлом.
+
+    В запросе проверяется только заголовок изображения, значение поля -
+    images.Upload с расширением по формату (images.ALLOWED_FORMATS).
+    Оригинал записывает create()/update() сериализатора, когда проверены
+    все поля: иначе при ошибке в другом поле файл остался бы без рецепта.
+    Полная проверка и производные картинки делаются обработчиком очереди
+    (manage.py process_images).
+    '''
+    default_error_messages = serializers.ImageField.default_error_messages
+
+    def __init__(self, variant=None, **kwargs):
+        self.variant = variant
+        super().__init__(**kwargs)
+
     def to_internal_value(self, data):
         if isinstance(data, str) and data.startswith('data:image'):
-            format, imgstr = data.split(';base64,')
-            ext = format.split('/')[-1]
-            data = ContentFile(base64.b64decode(imgstr), name='temp.' + ext)
-        return super().to_internal_value(data)
+            _, imgstr = data.split(';base64,')
+            data = ContentFile(base64.b64decode(imgstr), name='temp')
+        image = super().to_internal_value(data)
+        try:
+            with image_decode_duration.time(stage='upload'):
+                ext = images.get_extension(Image.open(image))
+        except Exception:
+            self.fail('invalid_image')
+        if ext is None:
+            self.fail('invalid_image')
+        image.seek(0)
+        return images.Upload(image.read(), ext)
+
+    def to_representation(self, value):
+        if not value:
+            return None
+        ready = getattr(
+            value.instance, 'image_status', ImageStatus.READY
+        ) == ImageStatus.READY
+        if self.variant and ready:
+            url = images.get_variant_url(value.name, self.variant)
+        else:
+            url = value.url
+        request = self.context.get('request')
+        if request is not None:
+            return request.build_absolute_uri(url)
+        return url
+
+
+class RecipeFragmentListSerializer(serializers.ListSerializer):
+    def to_representation(self, data):
+        recipes = data.all() if isinstance(data, Manager) else data
+        with timer('serializer'):
+            return render_recipes(self.child, list(recipes))
 
 
 class RecipeSerializer(serializers.ModelSerializer):
@@ -110,22 +189,25 @@ class RecipeSerializer(serializers.ModelSerializer):
                             default=serializers.CurrentUserDefault())
     ingredients = IngredientAmountSerializer(
         many=True, source='amounts', read_only=True)
-    is_favorited = serializers.SerializerMethodField()
-    is_in_shopping_cart = serializers.SerializerMethodField()
-    image = Base64ImageField(required=True,)
-
-    def get_is_favorited(self, obj):
-        if self.context['request'].user.is_authenticated:
-            return obj in self.context['request'].user.favorites.all()
-        return False
-
-    def get_is_in_shopping_cart(self, obj):
-        if self.context['request'].user.is_authenticated:
-            return obj in self.context['request'].user.shopping_cart.all()
-        return False
+    is_favorited = serializers.BooleanField(read_only=True)
+    is_in_shopping_cart = serializers.BooleanField(read_only=True)
+    image = Base64ImageField(required=True, variant='detail')
+    image_webp = Base64ImageField(
+        source='image', read_only=True, variant='webp')
+
+    def to_representation(self, instance):
+        with timer('serializer'):
+            return render_recipes(self, [instance])[0]
+
+    def render(self, instance):
+        '''представление рецепта без кэша'''
+        if hasattr(instance, 'author_is_subscribed'):
+            instance.author.is_subscribed = instance.author_is_subscribed
+        return super().to_representation(instance)
 
     class Meta:
         model = Recipe
+        list_serializer_class = RecipeFragmentListSerializer
         fields = (
             'id',
             'tags',
@@ -135,6 +217,8 @@ class RecipeSerializer(serializers.ModelSerializer):
             'is_in_shopping_cart',
             'name',
             'image',
+            'image_webp',
+            'image_status',
             'text',
             'cooking_time',
         )
@@ -148,7 +232,7 @@ class RecipeSerializer(serializers.ModelSerializer):
 
 
 class RecipeCreateSerializer(serializers.ModelSerializer):
-    tags = serializers.PrimaryKeyRelatedField(many=True, queryset=Tag.objects)
+    tags = BulkPrimaryKeyRelatedField(many=True, queryset=Tag.objects)
     author = serializers.SlugRelatedField(
         many=False, read_only=True, default=serializers.CurrentUserDefault(),
         slug_field='email')
@@ -175,28 +259,103 @@ class RecipeCreateSerializer(serializers.ModelSerializer):
             ),
         ]
 
+    def validate_tags(self, value):
+        field = self.fields['tags'].child_relation
+        tags = field.get_objects(value)
+        for pk in value:
+            if pk not in tags:
+                raise serializers.ValidationError(field.does_not_exist(pk))
+        return [tags[pk] for pk in dict.fromkeys(value)]
+
+    def validate_ingredients(self, value):
+        field = self.fields['ingredients'].child.fields['id']
+        ingredients = field.get_objects(
+            [entry['ingredient'] for entry in value])
+        errors = []
+        seen = set()
+        for entry in value:
+            pk = entry['ingredient']
+            if pk not in ingredients:
+                errors.append({'id': [field.does_not_exist(pk)]})
+            elif pk in seen:
+                errors.append({'id': ['Ингредиент повторяется в рецепте.']})
+            else:
+                errors.append({})
+                entry['ingredient'] = ingredients[pk]
+            seen.add(pk)
+        if any(errors):
+            raise serializers.ValidationError(errors)
+        return value
+
+    def save_image(self, validated_data):
+        '''записать оригинал загруженной картинки и её начальное состояние'''
+        if 'image' in validated_data:
+            name = images.store_original(*validated_data['image'])
+            validated_data['image'] = name
+            validated_data['image_status'] = tasks.get_image_status(name)
+
+    def schedule_image(self, recipe, validated_data):
+        if validated_data.get('image_status') == ImageStatus.PENDING:
+            tasks.enqueue_image(recipe.image.name)
+
+    def set_ingredients(self, recipe, ingredients_data):
+        '''Привести состав рецепта к переданному, меняя только отличия.
+
+        Возвращает id добавленных, удалённых и изменённых ингредиентов:
+        сигналы IngredientAmount на время изменения отключены, списки
+        покупок по ним обновляет update() одним пересчётом.
+        '''
+        amounts = {entry['ingredient'].pk: entry['amount']
+                   for entry in ingredients_data}
+        current = {item.ingredient_id: item for item in recipe.amounts.all()}
+        deleted = current.keys() - amounts.keys()
+        updated = []
+        for ingredient_id, item in current.items():
+            amount = amounts.get(ingredient_id)
+            if amount is not None and amount != item.amount:
+                item.amount = amount
+                updated.append(item)
+        created = [
+            IngredientAmount(recipe=recipe, ingredient_id=ingredient_id,
+                             amount=amount)
+            for ingredient_id, amount in amounts.items()
+            if ingredient_id not in current
+        ]
+        with amounts_handled([recipe.pk]):
+            if deleted:
+                recipe.amounts.filter(ingredient__in=deleted).delete()
+            IngredientAmount.objects.bulk_update(updated, ['amount'])
+            IngredientAmount.objects.bulk_create(created)
+        return (deleted | {item.ingredient_id for item in updated}
+                | {item.ingredient_id for item in created})
+
+    @transaction.atomic
     def update(self, instance, validated_data):
         ingredients_data = validated_data.pop('ingredients', None)
         tags = validated_data.pop('tags', None)
+        self.save_image(validated_data)
+        previous_image = instance.image.name
+        super().update(instance, validated_data)
+        if instance.image.name != previous_image:
+            transaction.on_commit(
+                lambda: tasks.delete_unused_image(previous_image))
         if tags:
             instance.tags.set(tags)
         if ingredients_data:
-            instance.amounts.all().delete()
-            IngredientAmount.objects.bulk_create(
-                [IngredientAmount(
-                    recipe=instance,
-                    ingredient=entry['ingredient'],
-                    amount=entry['amount']
-                ) for entry in ingredients_data],
-            )
-            super().update(instance, validated_data)
+            changed_ids = self.set_ingredients(instance, ingredients_data)
+            if changed_ids:
+                shopping_list.refresh_recipe(instance, changed_ids)
+        self.schedule_image(instance, validated_data)
         return instance
 
+    @transaction.atomic
     def create(self, validated_data):
         ingredients_data = validated_data.pop('ingredients', None)
         tags = validated_data.pop('tags', None)
+        self.save_image(validated_data)
         recipe = Recipe.objects.create(**validated_data)
         recipe.tags.set(tags)
+        self.schedule_image(recipe, validated_data)
 
         IngredientAmount.objects.bulk_create(
             [IngredientAmount(
@@ -208,7 +367,9 @@ class RecipeCreateSerializer(serializers.ModelSerializer):
         return recipe
 
 
-class RecipeListSerializer(serializers.ModelSerializer):
+class RecipeListSerializer(TimedSerializerMixin, serializers.ModelSerializer):
+    image = Base64ImageField(read_only=True, variant='list')
+
     class Meta:
         model = Recipe
         fields = (
@@ -219,50 +380,31 @@ class RecipeListSerializer(serializers.ModelSerializer):
         )
 
 
-class SubscriptionSerializer(serializers.ModelSerializer):
+class RecipeIdsSerializer(serializers.Serializer):
+    recipes = serializers.ListField(
+        child=serializers.IntegerField(min_value=1),
+        allow_empty=False, max_length=BATCH_LIMIT)
+
+
+class SubscriptionSerializer(TimedSerializerMixin,
+                             serializers.ModelSerializer):
     email = serializers.ReadOnlyField(source='author.email')
-    id = serializers.PrimaryKeyRelatedField(queryset=User.objects,
-                                            source='author.id')
+    id = serializers.ReadOnlyField(source='author.id')
     username = serializers.ReadOnlyField(source='author.username')
     first_name = serializers.ReadOnlyField(source='author.first_name')
     last_name = serializers.ReadOnlyField(source='author.last_name')
     is_subscribed = serializers.SerializerMethodField()
-    recipes = serializers.SerializerMethodField()
-    recipes_count = serializers.ReadOnlyField(source='author.recipes.count')
-
-    def get_recipes(self, obj):
-        recipes = obj.author.recipes.all()
-        recipes_limit = int(
-            self.context['request'].query_params.get(
-                'recipes_limit', RECIPES_LIMIT))
-        if recipes_limit and len(recipes) > recipes_limit:
-            recipes = recipes[:recipes_limit]
-        serializer = RecipeListSerializer(instance=recipes, many=True)
-        return serializer.data
+    recipes = RecipeListSerializer(
+        source='author.recipes_preview', many=True, read_only=True)
+    recipes_count = serializers.ReadOnlyField(source='author.recipes_count')
 
     def get_is_subscribed(self, obj):
+        if hasattr(obj, 'is_subscribed'):
+            return obj.is_subscribed
         current_user = self.context['request'].user
         return Subscription.objects.filter(
             subscriber=current_user, author=obj.author).exists()
 
-    def validate(self, data):
-        if data['author']['id'] == self.context['request'].user:
-            raise serializers.ValidationError(
-                {'errors': 'Нельзя подписаться на самого себя'})
-        if Subscription.objects.filter(subscriber=self.context['request'].user,
-                                       author=data['author']['id']).exists():
-            raise serializers.ValidationError(
-                {'errors': 'Уже подписан'})
-        return super().validate(data)
-
-    def create(self, validated_data):
-        subscriber = self.context['request'].user
-        author = validated_data['author']['id']
-        return Subscription.objects.create(
-            subscriber=subscriber,
-            author=author
-        )
-
     class Meta:
         model = Subscription
         fields = (
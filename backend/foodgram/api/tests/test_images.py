@@ -0,0 +1,93 @@
+import base64
+import io
+import os
+import tempfile
+
+from django.test import TestCase, override_settings
+from PIL import Image
+from rest_framework.test import APIClient
+
+from recipes import seeding
+from recipes.models import Recipe
+
+
+def get_image(color):
+    buffer = io.BytesIO()
+    Image.new('RGB', (8, 8), color).save(buffer, 'PNG')
+    return ('data:image/png;base64,'
+            + base64.b64encode(buffer.getvalue()).decode())
+
+
+class RecipeImageTest(TestCase):
+    '''Файлы картинок рецептов в хранилище.'''
+
+    @classmethod
+    def setUpClass(cls):
+        cls.directory = tempfile.TemporaryDirectory()
+        cls.settings_override = override_settings(
+            CACHES=seeding.LOCAL_CACHE, MEDIA_ROOT=cls.directory.name)
+        cls.settings_override.enable()
+        super().setUpClass()
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        cls.settings_override.disable()
+        cls.directory.cleanup()
+
+    @classmethod
+    def setUpTestData(cls):
+        seeding.seed(users=2, recipes_per_user=1, ingredients=5,
+                     favorites_per_user=0, carts_per_user=0,
+                     subscriptions_per_user=0)
+
+    def setUp(self):
+        self.context = seeding.get_context()
+        self.client = APIClient()
+        self.client.force_authenticate(self.context['viewer'])
+        self.recipe = Recipe.objects.get(pk=self.context['own_recipe'])
+
+    def get_files(self):
+        return {
+            os.path.relpath(os.path.join(root, name), self.directory.name)
+            for root, _, names in os.walk(self.directory.name)
+            for name in names
+        }
+
+    def get_payload(self, color, name):
+        return {
+            'name': name, 'text': 'Описание', 'cooking_time': 10,
+            'image': get_image(color), 'tags': self.context['tag_ids'],
+            'ingredients': [{'id': pk, 'amount': 10}
+                            for pk in self.context['ingredient_ids']],
+        }
+
+    def test_invalid_recipe_keeps_no_file(self):
+        files = self.get_files()
+        response = self.client.post(
+            '/api/recipes/', self.get_payload('red', self.recipe.name),
+            format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.get_files(), files)
+
+    def update_image(self, color):
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.patch(
+                f'/api/recipes/{self.recipe.pk}/',
+                self.get_payload(color, self.recipe.name), format='json')
+        self.assertEqual(response.status_code, 200)
+        self.recipe.refresh_from_db()
+        return self.recipe.image.name
+
+    def test_update_deletes_replaced_image(self):
+        previous = self.update_image('green')
+        current = self.update_image('blue')
+        files = self.get_files()
+        self.assertIn(current, files)
+        self.assertNotIn(previous, files)
+
+    def test_update_keeps_shared_image(self):
+        shared = self.update_image('green')
+        Recipe.objects.exclude(pk=self.recipe.pk).update(image=shared)
+        self.update_image('blue')
+        self.assertIn(shared, self.get_files())
@@ -0,0 +1,42 @@
+import tempfile
+
+from django.test import TestCase, override_settings
+from rest_framework.test import APIClient
+
+from recipes import seeding
+from users.models import User
+
+
+class MetricsTest(TestCase):
+    '''Метрики отдаются только персоналу.'''
+
+    @classmethod
+    def setUpClass(cls):
+        cls.directory = tempfile.TemporaryDirectory()
+        cls.settings_override = override_settings(
+            CACHES=seeding.LOCAL_CACHE, METRICS_DIR=cls.directory.name)
+        cls.settings_override.enable()
+        super().setUpClass()
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        cls.settings_override.disable()
+        cls.directory.cleanup()
+
+    def test_access(self):
+        user = User.objects.create_user(
+            email='user@example.com', username='user', password='password')
+        staff = User.objects.create_user(
+            email='staff@example.com', username='staff', password='password',
+            is_staff=True)
+        for name, viewer, status in (('anonymous', None, 401),
+                                     ('user', user, 403),
+                                     ('staff', staff, 200)):
+            with self.subTest(name):
+                client = APIClient()
+                if viewer is not None:
+                    client.force_authenticate(viewer)
+                response = client.get('/api/metrics')
+                self.assertEqual(response.status_code, status)
+        self.assertIn(b'# TYPE', response.content)
@@ -0,0 +1,70 @@
+import base64
+import json
+
+from django.test import TestCase, override_settings
+from rest_framework.test import APIClient
+
+from recipes import seeding
+from recipes.models import Recipe
+
+
+def encode_cursor(values, reverse=False):
+    return base64.urlsafe_b64encode(
+        json.dumps({'v': values, 'r': reverse}).encode()).decode()
+
+
+@override_settings(CACHES=seeding.LOCAL_CACHE)
+class KeysetPaginationTest(TestCase):
+    '''Курсорная пагинация ленты рецептов.'''
+
+    @classmethod
+    def setUpTestData(cls):
+        seeding.seed(users=3, recipes_per_user=5, ingredients=5,
+                     favorites_per_user=1, carts_per_user=1,
+                     subscriptions_per_user=1)
+
+    def setUp(self):
+        self.client = APIClient()
+
+    def test_pages(self):
+        response = self.client.get('/api/recipes/?cursor=&limit=4')
+        self.assertEqual(response.status_code, 200)
+        ids = [recipe['id'] for recipe in response.data['results']]
+        response = self.client.get(response.data['next'])
+        self.assertEqual(response.status_code, 200)
+        next_ids = [recipe['id'] for recipe in response.data['results']]
+        self.assertEqual(len(next_ids), 4)
+        self.assertFalse(set(ids) & set(next_ids))
+
+    def test_tampered_cursor(self):
+        for values in (['garbage', 1], [{'a': 1}, 1],
+                       ['2020-01-01T00:00:00+00:00', 'x'], [1]):
+            with self.subTest(values=values):
+                response = self.client.get(
+                    f'/api/recipes/?cursor={encode_cursor(values)}')
+                self.assertEqual(response.status_code, 404)
+                self.assertEqual(response.data['detail'], 'Неверный курсор.')
+
+    def test_search_keeps_relevance(self):
+        recipes = list(Recipe.objects.order_by('pub_date', 'id'))
+        # совпадения в названии у старых рецептов, в тексте - у новых:
+        # порядок по релевантности отличается от порядка по дате
+        for recipe in recipes[:3]:
+            recipe.name = f'Особый {recipe.name}'
+        for recipe in recipes[-3:]:
+            recipe.text = 'Особый рецепт'
+        Recipe.objects.bulk_update(recipes, ['name', 'text'])
+        expected = [recipe['id'] for recipe in self.client.get(
+            '/api/recipes/', {'search': 'Особый', 'limit': 100},
+        ).data['results']]
+        ids = []
+        response = self.client.get(
+            '/api/recipes/', {'search': 'Особый', 'cursor': '', 'limit': 2})
+        while True:
+            self.assertEqual(response.status_code, 200)
+            ids += [recipe['id'] for recipe in response.data['results']]
+            if not response.data['next']:
+                break
+            response = self.client.get(response.data['next'])
+        self.assertEqual(len(expected), 6)
+        self.assertEqual(ids, expected)
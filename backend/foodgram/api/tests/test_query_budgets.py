@@ -0,0 +1,122 @@
+import tempfile
+
+from django.core.cache import cache
+from django.db import connection, transaction
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APIClient
+
+from api.query_budgets import QUERY_BUDGETS
+from recipes import seeding, shopping_list, user_lists
+from recipes.models import IngredientAmount, Recipe
+from users.models import User
+
+SCALES = (
+    ('small', {'users': 5, 'recipes_per_user': 2, 'ingredients': 20,
+               'favorites_per_user': 2, 'carts_per_user': 2,
+               'subscriptions_per_user': 2}),
+    ('large', {'users': 40, 'recipes_per_user': 6, 'ingredients': 200,
+               'ingredients_per_recipe': 12, 'favorites_per_user': 20,
+               'carts_per_user': 8, 'subscriptions_per_user': 10}),
+)
+
+# the recipe updated and deleted by the budgets is put into this many carts
+OWN_RECIPE_CARTS = 4
+
+TRANSACTION_CONTROL = ('SAVEPOINT', 'RELEASE SAVEPOINT',
+                       'ROLLBACK TO SAVEPOINT')
+
+
+class QueryBudgetsTest(TestCase):
+    '''Каждый запрос из api/query_budgets.py на данных нескольких
+    размеров: не больше бюджета и не больше запросов на больших данных.'''
+
+    @classmethod
+    def setUpClass(cls):
+        cls.directory = tempfile.TemporaryDirectory()
+        cls.settings_override = override_settings(
+            CACHES=seeding.LOCAL_CACHE,
+            MEDIA_ROOT=cls.directory.name,
+            METRICS_DIR=cls.directory.name)
+        cls.settings_override.enable()
+        super().setUpClass()
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        cls.settings_override.disable()
+        cls.directory.cleanup()
+
+    def test_query_budgets(self):
+        counts = {scale: self.measure(params) for scale, params in SCALES}
+        for budget in QUERY_BUDGETS:
+            measured = {scale: counts[scale][budget.name]
+                        for scale, _ in SCALES}
+            with self.subTest(budget.name, **measured):
+                self.assertLessEqual(max(measured.values()),
+                                     budget.max_queries, 'over budget')
+                self.assertLessEqual(measured[SCALES[-1][0]],
+                                     measured[SCALES[0][0]],
+                                     'grows with data')
+
+    def measure(self, params):
+        with transaction.atomic():
+            seeding.seed(**params)
+            context = seeding.get_context()
+            self.prepare_own_recipes(context)
+            client = APIClient()
+            client.force_authenticate(context['viewer'])
+            try:
+                return {
+                    budget.name: self.count_queries(client, budget, context)
+                    for budget in QUERY_BUDGETS
+                }
+            finally:
+                transaction.set_rollback(True)
+
+    @staticmethod
+    def prepare_own_recipes(context):
+        '''Одинаковые условия для изменения и удаления рецептов viewer.
+
+        У own_recipe один тег, рецепты viewer лежат в нескольких корзинах
+        вместе с чужим рецептом, у которого есть первый ингредиент каждого
+        из них: строки списков покупок и уменьшаются, и удаляются на данных
+        любого размера.
+        '''
+        viewer, shared = context['viewer'], context['recipe']
+        Recipe.objects.get(pk=context['own_recipe']).tags.set(
+            context['tag_ids'][:1])
+        recipe_ids = list(Recipe.objects.filter(author=viewer).values_list(
+            'pk', flat=True))
+        first_ingredients = {}
+        for recipe_id, ingredient_id in IngredientAmount.objects.filter(
+                recipe__in=recipe_ids).order_by('pk').values_list(
+                    'recipe', 'ingredient'):
+            first_ingredients.setdefault(recipe_id, ingredient_id)
+        IngredientAmount.objects.bulk_create(
+            [IngredientAmount(recipe_id=shared, ingredient_id=pk, amount=1)
+             for pk in set(first_ingredients.values())],
+            ignore_conflicts=True)
+        users = User.objects.exclude(pk=viewer.pk)[:OWN_RECIPE_CARTS]
+        for user in users:
+            user_lists.add_many(user_lists.SHOPPING_CART, user,
+                                recipe_ids + [shared])
+        shopping_list.refresh([user.pk for user in users])
+
+    def count_queries(self, client, budget, context):
+        path = budget.path.format(**context)
+        data = budget.data(context) if budget.data else None
+        # cold caches: budgets hold for the first request as well
+        cache.clear()
+        with CaptureQueriesContext(connection) as queries:
+            response = getattr(client, budget.method)(
+                path, data, format='json')
+            if response.streaming:
+                b''.join(response.streaming_content)
+        self.assertLess(
+            response.status_code, 400,
+            f'{budget.name}: {budget.method.upper()} {path}')
+        # tests run inside a transaction, so savepoints are not counted:
+        # in production the outermost atomic() is BEGIN/COMMIT
+        return sum(not query['sql'].startswith(TRANSACTION_CONTROL)
+                   for query in queries)
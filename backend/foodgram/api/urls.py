@@ -1,7 +1,8 @@
 from django.urls import include, path
 from rest_framework.routers import SimpleRouter
 
-from .views import IngredientViewSet, RecipeViewSet, TagViewSet, UserViewSet
+from .views import (IngredientViewSet, RecipeViewSet, TagViewSet, UserViewSet,
+                    metrics)
 
 router = SimpleRouter()
 router.register('tags', TagViewSet)
@@ -11,5 +12,6 @@ router.register('users', UserViewSet)
 
 urlpatterns = [
     path('auth/', include('djoser.urls.authtoken')),
+    path('metrics', metrics, name='metrics'),
     path('', include(router.urls))
 ]
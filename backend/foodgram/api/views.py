@@ -1,24 +1,38 @@
-from django.db.models import Sum
-from django.http import FileResponse, HttpResponse
+from django.db import IntegrityError, transaction
+from django.db.models import BooleanField, Exists, OuterRef, Value
+from django.http import HttpResponse, StreamingHttpResponse
 from django_filters.rest_framework import DjangoFilterBackend
 from djoser.views import UserViewSet as DjoserUserViewSet
 from rest_framework import status
-from rest_framework.decorators import action
+from rest_framework.decorators import action, api_view, permission_classes
 from rest_framework.mixins import ListModelMixin, RetrieveModelMixin
-from rest_framework.permissions import IsAuthenticated
+from rest_framework.permissions import IsAdminUser, IsAuthenticated
 from rest_framework.response import Response
+from rest_framework.settings import api_settings
 from rest_framework.viewsets import GenericViewSet, ModelViewSet
 
-from .filters import InrgedientFilter, RecipeFilter
+from .cache import CatalogCacheMixin
+from .constants import MAX_RECIPES_LIMIT, RECIPES_LIMIT
+from .core import OptionalKeysetPagination
+from .exporters import EXPORTERS, TextExporter
+from .filters import RecipeFilter
 from .permissions import IsAdmin, IsAuthorIsAdminOrReadOnly
+from .renderers import CSVRenderer, PDFRenderer, TextRenderer
 from .serializers import (IngredientSerializer, RecipeCreateSerializer,
-                          RecipeListSerializer, RecipeSerializer,
-                          SubscriptionSerializer, TagSerializer)
-from recipes.models import Ingredient, IngredientAmount, Recipe, Tag
+                          RecipeIdsSerializer, RecipeListSerializer,
+                          RecipeSerializer, SubscriptionSerializer,
+                          TagSerializer)
+from recipes import tasks, user_lists
+from recipes.autocomplete import ingredient_index
+from recipes.metrics import registry
+from recipes.models import Ingredient, Recipe, ShoppingListItem, Tag
+from recipes.signals import delete_recipes
 from users.models import Subscription
+from users.signals import subscriptions_handled
 
 
-class TagViewSet(GenericViewSet, ListModelMixin, RetrieveModelMixin):
+class TagViewSet(CatalogCacheMixin, GenericViewSet, ListModelMixin,
+                 RetrieveModelMixin):
     queryset = Tag.objects.all()
     serializer_class = TagSerializer
     permission_classes = (IsAdmin,)
@@ -30,6 +44,30 @@ class RecipeViewSet(ModelViewSet):
     permission_classes = (IsAuthorIsAdminOrReadOnly,)
     filter_backends = [DjangoFilterBackend]
     filterset_class = RecipeFilter
+    pagination_class = OptionalKeysetPagination
+
+    @property
+    def cursor_ordering(self):
+        # при поиске лента упорядочена по релевантности (см.
+        # recipes.search), поэтому rank входит в ключ курсора
+        if self.request.query_params.get('search', '').strip():
+            return ('-rank', '-pub_date', '-id')
+        return ('-pub_date', '-id')
+
+    def get_queryset(self):
+        if self.action in ['list', 'retrieve']:
+            return self.get_display_queryset()
+        return super().get_queryset()
+
+    def get_display_queryset(self):
+        # связанные объекты загружаются сериализатором только для
+        # рецептов, которых нет в кэше (см. api.cache.render_recipes)
+        return Recipe.objects.with_user_flags(self.request.user)
+
+    def get_display_data(self, instance):
+        instance = self.get_display_queryset().get(pk=instance.pk)
+        return RecipeSerializer(
+            instance, context=self.get_serializer_context()).data
 
     def get_serializer_class(self):
         if self.action in ['update', 'partial_update', 'create']:
@@ -48,146 +86,241 @@ class RecipeViewSet(ModelViewSet):
         serializer = self.get_serializer(data=request.data)
         serializer.is_valid(raise_exception=True)
         instance = self.perform_create(serializer)
-        instance_serializer = RecipeSerializer(
-            instance, context={'request': request})
-        return Response(instance_serializer.data)
+        return Response(self.get_display_data(instance))
 
     def update(self, request, *args, **kwargs):
         serializer = self.get_serializer(data=request.data,
-                                         instance=self.get_object(),)
+                                         instance=self.get_object(),
+                                         partial=kwargs.get('partial', False))
         serializer.is_valid(raise_exception=True)
         instance = self.perform_update(serializer)
-        instance_serializer = RecipeSerializer(
-            instance, context={'request': request})
-        return Response(instance_serializer.data)
+        return Response(self.get_display_data(instance))
 
     def perform_destroy(self, instance):
-        instance.image.delete()
-        return super().perform_destroy(instance)
+        image = instance.image.name
+        super().perform_destroy(instance)
+        transaction.on_commit(lambda: tasks.delete_unused_image(image))
+
+    def add_to_list(self, relation, error):
+        recipe = self.get_object()
+        if not user_lists.add(relation, self.request.user, recipe):
+            return Response(status=status.HTTP_400_BAD_REQUEST,
+                            data={'errors': error})
+        serializer = RecipeListSerializer(
+            recipe, context=self.get_serializer_context())
+        return Response(serializer.data)
+
+    def remove_from_list(self, relation, error):
+        recipe = self.get_object()
+        if not user_lists.remove(relation, self.request.user, recipe):
+            return Response(status=status.HTTP_400_BAD_REQUEST,
+                            data={'errors': error})
+        return Response(status=status.HTTP_204_NO_CONTENT)
 
     @action(detail=True, methods=['post'],
             permission_classes=[IsAuthenticated])
     def shopping_cart(self, request, pk=None):
-        recipe = self.get_object()
-        current_user = self.request.user
-        if recipe in current_user.shopping_cart.all():
-            return Response(
-                status=status.HTTP_400_BAD_REQUEST,
-                data={'errors': 'Рецепт уже в списке покупок.'})
-        current_user.shopping_cart.add(recipe)
-        serializer = RecipeListSerializer(recipe)
-        return Response(serializer.data)
+        return self.add_to_list(user_lists.SHOPPING_CART,
+                                'Рецепт уже в списке покупок.')
 
     @shopping_cart.mapping.delete
     def delete_shopping_cart(self, request, pk=None):
-        recipe = self.get_object()
-        current_user = self.request.user
-        if recipe not in current_user.shopping_cart.all():
-            return Response(
-                status=status.HTTP_400_BAD_REQUEST,
-                data={'errors': 'Этого рецепта нет в списке покупок.'})
-        current_user.shopping_cart.remove(recipe)
-        return Response(status=status.HTTP_204_NO_CONTENT)
+        return self.remove_from_list(user_lists.SHOPPING_CART,
+                                     'Этого рецепта нет в списке покупок.')
 
     @action(detail=False, methods=['get'],
-            permission_classes=[IsAuthenticated])
+            permission_classes=[IsAuthenticated],
+            renderer_classes=[*api_settings.DEFAULT_RENDERER_CLASSES,
+                              TextRenderer, CSVRenderer, PDFRenderer])
     def download_shopping_cart(self, request):
-        recipes_in_cart = self.request.user.shopping_cart.values('id')
-        amounts_in_cart = (IngredientAmount.objects.filter(
-            recipe__in=recipes_in_cart)
-            .values('ingredient__name', 'ingredient__measurement_unit')
-            .annotate(total_amount=Sum('amount'))
-            .order_by('ingredient__name'))
-
         user = self.request.user
-        filename = f'{user.username}_shopping_list.txt'
-        shopping_list = [
-            f'Список покупок для:\n\n{user.first_name}\n'
-        ]
-
-        for ingredient in amounts_in_cart:
-            shopping_list.append(
-                f'{ingredient["ingredient__name"].capitalize()} ('
-                f'{ingredient["ingredient__measurement_unit"]}) - '
-                f'{ingredient["total_amount"]}\n'
-            )
-        shopping_list = '\n'.join(shopping_list)
-        response = HttpResponse(
-            shopping_list, content_type='text.txt; charset=utf-8'
+        items = (
+            ShoppingListItem.objects
+            .filter(user=user)
+            .order_by('ingredient__name')
         )
-        response['Content-Disposition'] = f'attachment; filename={filename}'
+        exporter = EXPORTERS.get(
+            request.accepted_renderer.format, TextExporter)(user, items)
+        response = StreamingHttpResponse(
+            exporter.timed_stream(), content_type=exporter.content_type)
+        response['Content-Disposition'] = (
+            f'attachment; filename={exporter.filename}')
         return response
 
+    @action(detail=False, methods=['post', 'delete'],
+            permission_classes=[IsAuthenticated],
+            url_path='shopping_cart', url_name='shopping-cart-batch')
+    def shopping_cart_batch(self, request):
+        return self.change_lists(request, user_lists.SHOPPING_CART)
+
+    @action(detail=False, methods=['post', 'delete'],
+            permission_classes=[IsAuthenticated],
+            url_path='favorite', url_name='favorite-batch')
+    def favorite_batch(self, request):
+        return self.change_lists(request, user_lists.FAVORITES)
+
+    def change_lists(self, request, relation):
+        '''Добавить или удалить несколько рецептов за один запрос.
+
+        Для каждого переданного id возвращается результат: added, exists,
+        removed, absent или not_found.
+        '''
+        serializer = RecipeIdsSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        recipe_ids = list(dict.fromkeys(serializer.validated_data['recipes']))
+        found = set(Recipe.objects.filter(pk__in=recipe_ids).values_list(
+            'pk', flat=True))
+        if request.method == 'POST':
+            done, _ = user_lists.add_many(relation, request.user, found)
+            done_status, skipped_status = 'added', 'exists'
+        else:
+            done = user_lists.remove_many(relation, request.user, found)
+            done_status, skipped_status = 'removed', 'absent'
+        results = []
+        for pk in recipe_ids:
+            if pk not in found:
+                result = 'not_found'
+            elif pk in done:
+                result = done_status
+            else:
+                result = skipped_status
+            results.append({'id': pk, 'status': result})
+        return Response({'results': results})
+
     @action(detail=True, methods=['post'],
             permission_classes=[IsAuthenticated])
     def favorite(self, request, pk=None):
-        recipe = self.get_object()
-        current_user = self.request.user
-        if recipe in current_user.favorites.all():
-            return Response(
-                status=status.HTTP_400_BAD_REQUEST,
-                data={'errors': 'Рецепт уже в избранном.'})
-        current_user.favorites.add(recipe)
-        serializer = RecipeListSerializer(recipe)
-        return Response(serializer.data)
+        return self.add_to_list(user_lists.FAVORITES,
+                                'Рецепт уже в избранном.')
 
     @favorite.mapping.delete
     def delete_favorite(self, request, pk=None):
-        recipe = self.get_object()
-        current_user = self.request.user
-        if recipe not in current_user.favorites.all():
-            return Response(
-                status=status.HTTP_400_BAD_REQUEST,
-                data={'errors': 'Этого рецепта нет в избранном.'})
-        current_user.favorites.remove(recipe)
-        return Response(status=status.HTTP_204_NO_CONTENT)
+        return self.remove_from_list(user_lists.FAVORITES,
+                                     'Этого рецепта нет в избранном.')
 
 
-class IngredientViewSet(GenericViewSet, ListModelMixin, RetrieveModelMixin):
+class IngredientViewSet(CatalogCacheMixin, GenericViewSet, ListModelMixin,
+                        RetrieveModelMixin):
     queryset = Ingredient.objects.all()
     serializer_class = IngredientSerializer
     permission_classes = (IsAdmin,)
-    filter_backends = [DjangoFilterBackend]
-    filterset_class = InrgedientFilter
     pagination_class = None
 
+    def list(self, request, *args, **kwargs):
+        name = request.query_params.get('name')
+        if name:
+            return Response(ingredient_index.search(name))
+        return super().list(request, *args, **kwargs)
+
 
 class UserViewSet(DjoserUserViewSet):
+    pagination_class = OptionalKeysetPagination
+
+    @transaction.atomic
+    def perform_destroy(self, instance):
+        # рецепты одним проходом, а не сигналами по каждому при каскаде
+        delete_recipes(instance.recipes.all())
+        with subscriptions_handled(instance):
+            super().perform_destroy(instance)
+
+    def get_queryset(self):
+        user = self.request.user
+        if (self.action not in ('list', 'retrieve')
+                or not user.is_authenticated):
+            return super().get_queryset()
+        return super().get_queryset().annotate(is_subscribed=Exists(
+            Subscription.objects.filter(
+                subscriber=user, author=OuterRef('pk'))))
+
+    @property
+    def cursor_ordering(self):
+        if self.action == 'subscriptions':
+            return ('author__username', 'id')
+        return ('email', 'id')
+
+    def get_recipes_limit(self):
+        '''recipes_limit из запроса, не больше MAX_RECIPES_LIMIT;
+        неверные и неположительные значения заменяются на RECIPES_LIMIT'''
+        try:
+            recipes_limit = int(self.request.query_params.get(
+                'recipes_limit', RECIPES_LIMIT))
+        except ValueError:
+            recipes_limit = RECIPES_LIMIT
+        if recipes_limit <= 0:
+            recipes_limit = RECIPES_LIMIT
+        return min(recipes_limit, MAX_RECIPES_LIMIT)
+
+    def get_subscriptions_queryset(self):
+        '''подписки с авторами, превью рецептов добавляет
+        set_recipes_preview'''
+        return (
+            Subscription.objects
+            .filter(subscriber=self.request.user)
+            .select_related('author')
+            .annotate(
+                is_subscribed=Value(True, output_field=BooleanField()))
+        )
+
+    def set_recipes_preview(self, subscriptions):
+        '''Последние recipes_limit рецептов каждого автора одним запросом.
+
+        Рецепты ограничиваются на стороне базы оконной функцией (см.
+        RecipeQuerySet.latest_by_author), загружаются только поля
+        RecipeListSerializer.
+        '''
+        authors = {}
+        for subscription in subscriptions:
+            subscription.author.recipes_preview = []
+            authors[subscription.author_id] = subscription.author
+        if not authors:
+            return
+        recipes = (
+            Recipe.objects.filter(author__in=authors)
+            .only('id', 'name', 'image', 'cooking_time', 'image_status',
+                  'author')
+            .latest_by_author(self.get_recipes_limit())
+        )
+        for recipe in recipes:
+            authors[recipe.author_id].recipes_preview.append(recipe)
+
     @action(detail=False, methods=['get'],
             permission_classes=[IsAuthenticated])
     def subscriptions(self, request):
         user_subscriptions = (
-            Subscription.objects
-            .filter(subscriber=request.user)
+            self.get_subscriptions_queryset()
             .order_by('author__username')
         )
         page = self.paginate_queryset(user_subscriptions)
-        if page is not None:
-            serializer = SubscriptionSerializer(
-                page,
-                context={'request': request},
-                many=True,
-            )
-            return self.get_paginated_response(serializer.data)
+        subscriptions = list(user_subscriptions) if page is None else page
+        self.set_recipes_preview(subscriptions)
         serializer = SubscriptionSerializer(
-            user_subscriptions,
+            subscriptions,
             context={'request': request},
             many=True,
         )
-        return Response(serializer.data)
+        if page is None:
+            return Response(serializer.data)
+        return self.get_paginated_response(serializer.data)
 
     @action(detail=True, methods=['post'],
             permission_classes=[IsAuthenticated])
     def subscribe(self, request, id=None):
         author = self.get_object()
-        serializer = SubscriptionSerializer(
-            data={'id': author.id, },
-            context={'request': request}
-        )
-        if serializer.is_valid():
-            subscription = serializer.save()
-        else:
-            return Response(serializer.errors)
+        if author == request.user:
+            return Response(
+                status=status.HTTP_400_BAD_REQUEST,
+                data={'errors': 'Нельзя подписаться на самого себя'})
+        try:
+            with transaction.atomic():
+                subscription = Subscription.objects.create(
+                    subscriber=request.user, author=author)
+        except IntegrityError:
+            return Response(
+                status=status.HTTP_400_BAD_REQUEST,
+                data={'errors': 'Уже подписан'})
+        subscription = self.get_subscriptions_queryset().get(
+            pk=subscription.pk)
+        self.set_recipes_preview([subscription])
         serializer = SubscriptionSerializer(subscription,
                                             context={'request': request})
         return Response(serializer.data)
@@ -195,16 +328,22 @@ class UserViewSet(DjoserUserViewSet):
     @subscribe.mapping.delete
     def delete_subscribe(self, request, id=None):
         author = self.get_object()
-        current_user = self.request.user
-        if not Subscription.objects.filter(
-            subscriber=current_user,
-            author=author,
-        ).exists():
+        deleted, _ = Subscription.objects.filter(
+            subscriber=request.user, author=author).delete()
+        if not deleted:
             return Response(
                 status=status.HTTP_400_BAD_REQUEST,
                 data={'errors': 'Этого автора нет в подписках.'})
-        Subscription.objects.filter(
-            subscriber=current_user,
-            author=author
-        ).delete()
         return Response(status=status.HTTP_204_NO_CONTENT)
+
+
+@api_view(['GET'])
+@permission_classes([IsAdminUser])
+def metrics(request):
+    '''Метрики всех процессов в текстовом формате Prometheus.
+
+    Доступны только персоналу: сборщик метрик передаёт токен
+    пользователя с is_staff.
+    '''
+    return HttpResponse(registry.render(),
+                        content_type='text/plain; version=0.0.4')
@@ -1,4 +1,5 @@
 import os
+import tempfile
 from pathlib import Path
 
 from django.core.management.utils import get_random_secret_key
@@ -33,6 +34,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'api.instrumentation.InstrumentationMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -112,7 +114,7 @@ REST_FRAMEWORK = {
     ],
 
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework.authentication.TokenAuthentication',
+        'api.authentication.CachedTokenAuthentication',
     ),
 
     'DEFAULT_PAGINATION_CLASS': 'api.core.CustomPageNumberPagination',
@@ -135,6 +137,38 @@ DJOSER = {
     }
 }
 
+INSTRUMENTATION = {
+    # share of requests measured, 0 disables instrumentation
+    'SAMPLE_RATE': float(os.getenv('INSTRUMENTATION_SAMPLE_RATE',
+                                   default=0.01)),
+    'SLOW_REQUEST_MS': int(os.getenv('SLOW_REQUEST_MS', default=500)),
+    # timings reveal query counts to clients: on in development only
+    'SERVER_TIMING': os.getenv('SERVER_TIMING', default=str(DEBUG)) == 'True',
+    # repeated SQL fingerprints logged for a slow request
+    'TOP_QUERIES': 5,
+}
+
+# per-process metric files, shared by gunicorn workers and image workers
+METRICS_DIR = os.getenv(
+    'METRICS_DIR',
+    default=os.path.join(tempfile.gettempdir(), 'foodgram-metrics'))
+
+METRICS_FLUSH_INTERVAL = 1
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler'},
+    },
+    'loggers': {
+        'api.instrumentation': {
+            'handlers': ['console'],
+            'level': 'WARNING',
+        },
+    },
+}
+
 MEDIA_URL = '/media/'
 
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
@@ -0,0 +1,9 @@
+import os
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'foodgram.settings')
+
+
+def on_starting(server):
+    # METRICS_DIR outlives the container: start counting from zero
+    from recipes.metrics import registry
+    registry.clear()
@@ -1,6 +1,6 @@
 from django.contrib import admin
 
-from recipes.models import Ingredient, IngredientAmount, Recipe, Tag
+from recipes.models import ImageTask, Ingredient, IngredientAmount, Recipe, Tag
 from users.admin import StaffRequired
 
 
@@ -12,16 +12,12 @@ class InrgedientQuantityInline(admin.TabularInline):
 
 
 class RecipeAdmin(StaffRequired, admin.ModelAdmin):
-    list_display = ('name', 'author')
+    list_display = ('name', 'author', 'favorites_count', 'in_carts_count')
     search_fields = ('name',)
     list_filter = ('author', 'tags',)
     filter_horizontal = ('tags',)
     inlines = (InrgedientQuantityInline,)
-    readonly_fields = ('favorite_count',)
-
-    @admin.display(description='Число добавлений в избранное')
-    def favorite_count(self, instance):
-        return instance.favorited.count()
+    readonly_fields = ('favorites_count',)
 
 
 class IngredientAdmin(StaffRequired, admin.ModelAdmin):
@@ -39,7 +35,14 @@ class IngredientAmountAdmin(StaffRequired, admin.ModelAdmin):
     list_display = ('ingredient', 'recipe')
 
 
+class ImageTaskAdmin(StaffRequired, admin.ModelAdmin):
+    list_display = ('image', 'status', 'attempts', 'updated')
+    list_filter = ('status',)
+    readonly_fields = ('image', 'attempts', 'error', 'updated')
+
+
 admin.site.register(Recipe, RecipeAdmin)
 admin.site.register(Ingredient, IngredientAdmin)
 admin.site.register(Tag, TagAdmin)
 admin.site.register(IngredientAmount, IngredientAmountAdmin)
+admin.site.register(ImageTask, ImageTaskAdmin)
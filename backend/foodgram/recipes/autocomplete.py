@@ -0,0 +1,99 @@
+import threading
+import time
+from bisect import bisect_left
+from collections import defaultdict
+
+from recipes.models import Ingredient
+from recipes.versions import get_model_version
+
+# How often the version of Ingredient data is read from the database, in
+# seconds: other processes see a change after at most this delay.
+CHECK_INTERVAL = 5
+
+# Substrings up to this length are indexed, longer queries are looked up
+# by their substrings of this length and then checked.
+NGRAM_SIZE = 3
+
+
+def get_ngrams(key, size):
+    return {key[start:start + size] for start in range(len(key) - size + 1)}
+
+
+class IngredientIndex:
+    '''Отсортированный индекс названий ингредиентов в памяти процесса.
+
+    Поиск по префиксу идёт бинарным поиском, совпадения по подстроке
+    ищутся по индексу n-грамм. Индекс перестраивается, когда меняется
+    версия данных Ingredient (см. recipes.signals), которая хранится
+    в базе и общая для всех процессов; версия читается не чаще раза
+    в CHECK_INTERVAL секунд.
+    '''
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._version = None
+        self._checked_at = None
+        self._index = ([], [], {})
+
+    def search(self, query):
+        keys, entries, ngrams = self._get_index()
+        query = query.casefold()
+        start = bisect_left(keys, query)
+        end = bisect_left(keys, query + chr(0x10FFFF), start)
+        results = entries[start:end]
+        results.extend(
+            entries[position] for position in sorted(
+                self._find_substring(keys, ngrams, query))
+            if not start <= position < end
+        )
+        return results
+
+    @staticmethod
+    def _find_substring(keys, ngrams, query):
+        '''позиции названий, содержащих query'''
+        if len(query) <= NGRAM_SIZE:
+            return ngrams.get(query, ())
+        candidates = sorted(
+            (ngrams.get(ngram, frozenset())
+             for ngram in get_ngrams(query, NGRAM_SIZE)), key=len)
+        positions = candidates[0].intersection(*candidates[1:])
+        return [position for position in positions if query in keys[position]]
+
+    def expire(self):
+        '''перечитать версию при следующем поиске'''
+        self._checked_at = None
+
+    def _get_index(self):
+        now = time.monotonic()
+        checked_at = self._checked_at
+        if checked_at is not None and now - checked_at < CHECK_INTERVAL:
+            return self._index
+        version = get_model_version(Ingredient)
+        if version != self._version:
+            with self._lock:
+                if version != self._version:
+                    self._index = self._build()
+                    self._version = version
+        self._checked_at = now
+        return self._index
+
+    def _build(self):
+        rows = sorted(
+            (name.casefold(), pk, name, measurement_unit)
+            for pk, name, measurement_unit in Ingredient.objects.values_list(
+                'id', 'name', 'measurement_unit')
+        )
+        entries = [
+            {'id': pk, 'name': name, 'measurement_unit': measurement_unit}
+            for _, pk, name, measurement_unit in rows
+        ]
+        keys = [row[0] for row in rows]
+        ngrams = defaultdict(set)
+        for position, key in enumerate(keys):
+            for size in range(1, NGRAM_SIZE + 1):
+                for ngram in get_ngrams(key, size):
+                    ngrams[ngram].add(position)
+        return keys, entries, dict(ngrams)
+
+
+ingredient_index = IngredientIndex()
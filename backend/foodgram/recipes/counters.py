@@ -0,0 +1,47 @@
+from django.contrib.auth import get_user_model
+from django.db.models import Count, F, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+from recipes.models import Recipe
+from users.models import Subscription
+
+User = get_user_model()
+
+
+def count_subquery(model, field):
+    '''число строк model, ссылающихся через field на внешнюю строку'''
+    return Coalesce(Subquery(
+        model.objects
+        .filter(**{field: OuterRef('pk')})
+        .order_by()
+        .values(field)
+        .annotate(count=Count('pk'))
+        .values('count')
+    ), 0)
+
+
+def get_counters():
+    return (
+        (Recipe, 'favorites_count',
+         count_subquery(User.favorites.through, 'recipe')),
+        (Recipe, 'in_carts_count',
+         count_subquery(User.shopping_cart.through, 'recipe')),
+        (User, 'recipes_count', count_subquery(Recipe, 'author')),
+        (User, 'subscribers_count', count_subquery(Subscription, 'author')),
+    )
+
+
+def reconcile(fix=True):
+    '''Сверить денормализованные счётчики с данными и исправить расхождения.
+
+    Возвращает словарь {'Model.field': число строк с расхождением}.
+    '''
+    drift = {}
+    for model, field, actual in get_counters():
+        wrong = model.objects.annotate(actual=actual).exclude(
+            **{field: F('actual')})
+        drift[f'{model.__name__}.{field}'] = wrong.count()
+        if fix and drift[f'{model.__name__}.{field}']:
+            model.objects.filter(pk__in=wrong.values('pk')).update(
+                **{field: actual})
+    return drift
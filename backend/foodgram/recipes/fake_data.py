@@ -0,0 +1,227 @@
+import csv
+import io
+import random
+from datetime import timedelta
+
+from django.contrib.auth import get_user_model
+from django.core.management.color import no_style
+from django.db import DEFAULT_DB_ALIAS, connection, connections, transaction
+from django.utils import timezone
+
+from recipes import shopping_list
+from recipes.models import IngredientAmount, Recipe
+from recipes.seeding import SEED_IMAGE, get_max_pk
+from users.models import Subscription
+
+User = get_user_model()
+
+# parameters of the current generation, set in every worker process
+plan = {}
+
+
+def init_worker(options):
+    plan.clear()
+    plan.update(options)
+
+
+def make_plan(users, recipes, ingredient_ids, tag_ids, **options):
+    '''Параметры генерации: диапазоны id новых пользователей и рецептов.
+
+    id выделяются заранее, поэтому части данных можно создавать
+    в разных процессах независимо и в любом порядке.
+    '''
+    first_user = get_max_pk(User) + 1
+    first_recipe = get_max_pk(Recipe) + 1
+    rnd = random.Random(f'{options["random_seed"]}-catalog')
+    # popular ingredients and tags are spread over the catalog
+    ingredient_ids = rnd.sample(ingredient_ids, len(ingredient_ids))
+    tag_ids = rnd.sample(tag_ids, len(tag_ids))
+    return {
+        **options,
+        'users': users,
+        'recipes': recipes,
+        'first_user': first_user,
+        'first_recipe': first_recipe,
+        'ingredient_ids': ingredient_ids,
+        'tag_ids': tag_ids,
+        'now': timezone.now(),
+    }
+
+
+def get_tasks(total, chunk_size):
+    '''(номер, смещение, размер) частей по chunk_size строк'''
+    return [(number, start, min(chunk_size, total - start))
+            for number, start in enumerate(range(0, total, chunk_size))]
+
+
+def get_random(kind, number):
+    '''генератор части зависит только от зерна, вида и номера части'''
+    return random.Random(f'{plan["random_seed"]}-{kind}-{number}')
+
+
+def power_law_index(rnd, size, alpha):
+    '''Случайный индекс 0..size-1 со степенным распределением.
+
+    Вероятность индекса k убывает как (k + 1) ** -alpha: первые
+    элементы выпадают намного чаще остальных.
+    '''
+    u = rnd.random()
+    if alpha == 1:
+        rank = size ** u
+    else:
+        rank = ((size ** (1 - alpha) - 1) * u + 1) ** (1 / (1 - alpha))
+    return min(int(rank), size) - 1
+
+
+def pick_distinct(rnd, population, count, alpha):
+    '''до count разных элементов population со степенной популярностью'''
+    count = min(count, len(population))
+    picked = set()
+    for _ in range(count * 10):
+        if len(picked) == count:
+            break
+        picked.add(population[power_law_index(rnd, len(population), alpha)])
+    return picked
+
+
+def pick_count(rnd, mean):
+    '''неотрицательное число со средним mean и длинным хвостом'''
+    return int(rnd.expovariate(1 / mean)) if mean > 0 else 0
+
+
+def write_rows(model, names, rows):
+    '''Записать строки одним COPY на PostgreSQL, иначе executemany.
+
+    rows — кортежи значений полей names, остальные поля получают
+    значения по умолчанию, id без значения заполняет база. Объекты
+    моделей не создаются, auto_now_add и сигналы не срабатывают.
+    '''
+    if not rows:
+        return
+    # the connection itself, not the proxy: it is used for every value
+    db = connections[DEFAULT_DB_ALIAS]
+    fields = [model._meta.get_field(name) for name in names]
+    defaults = [field for field in model._meta.concrete_fields
+                if field not in fields and not field.primary_key]
+    fields += defaults
+    defaults = [field.get_db_prep_save(field.get_default(), db)
+                for field in defaults]
+    # ints and strings are passed as is, only dates need conversion
+    rows = [[value if type(value) in (int, str)
+             else field.get_db_prep_save(value, db)
+             for field, value in zip(fields, row)] + defaults
+            for row in rows]
+    table = db.ops.quote_name(model._meta.db_table)
+    columns = ', '.join(db.ops.quote_name(field.column) for field in fields)
+    with db.cursor() as cursor:
+        if db.vendor == 'postgresql':
+            buffer = io.StringIO()
+            csv.writer(buffer).writerows(rows)
+            buffer.seek(0)
+            cursor.copy_expert(
+                f'COPY {table} ({columns}) FROM STDIN WITH CSV', buffer)
+        else:
+            placeholders = ', '.join(['%s'] * len(fields))
+            cursor.executemany(
+                f'INSERT INTO {table} ({columns}) VALUES ({placeholders})',
+                rows)
+
+
+def get_author(rnd):
+    return plan['first_user'] + power_law_index(
+        rnd, plan['users'], plan['alpha'])
+
+
+def generate_users(task):
+    number, start, size = task
+    first = plan['first_user'] + start
+    users = [(pk, f'user{pk}', f'user{pk}@example.com', 'Имя', 'Фамилия',
+              '!', plan['now'])
+             for pk in range(first, first + size)]
+    with transaction.atomic():
+        write_rows(User, ('id', 'username', 'email', 'first_name',
+                          'last_name', 'password', 'date_joined'), users)
+    return len(users)
+
+
+def generate_recipes(task):
+    '''Рецепты части с ингредиентами и тегами.
+
+    Авторы выбираются по степенному закону: у немногих пользователей
+    большинство рецептов.
+    '''
+    number, start, size = task
+    rnd = get_random('recipes', number)
+    first = plan['first_recipe'] + start
+    recipes, amounts, tags = [], [], []
+    for pk in range(first, first + size):
+        recipes.append((
+            pk, get_author(rnd), f'Рецепт {pk}', 'Описание рецепта',
+            SEED_IMAGE, rnd.randint(5, 180),
+            plan['now'] - timedelta(
+                seconds=rnd.randint(0, plan['days'] * 86400))))
+        ingredients = pick_distinct(
+            rnd, plan['ingredient_ids'],
+            max(1, round(rnd.gauss(plan['ingredients_per_recipe'],
+                                   plan['ingredients_per_recipe'] / 3))),
+            plan['alpha'])
+        amounts.extend((pk, ingredient_id, rnd.randint(1, 500))
+                       for ingredient_id in ingredients)
+        tags.extend((pk, tag_id) for tag_id in pick_distinct(
+            rnd, plan['tag_ids'], rnd.randint(1, 3), plan['alpha']))
+    with transaction.atomic():
+        write_rows(Recipe, ('id', 'author_id', 'name', 'text', 'image',
+                            'cooking_time', 'pub_date'), recipes)
+        write_rows(IngredientAmount, ('recipe_id', 'ingredient_id',
+                                      'amount'), amounts)
+        write_rows(Recipe.tags.through, ('recipe_id', 'tag_id'), tags)
+    return len(recipes) + len(amounts) + len(tags)
+
+
+def generate_relations(task):
+    '''Избранное, корзины и подписки пользователей части.
+
+    Популярность рецептов и авторов степенная, число связей
+    у пользователя распределено экспоненциально.
+    '''
+    number, start, size = task
+    rnd = get_random('relations', number)
+    recipe_ids = range(plan['first_recipe'],
+                       plan['first_recipe'] + plan['recipes'])
+    first = plan['first_user'] + start
+    rows = {User.favorites.through: [], User.shopping_cart.through: [],
+            Subscription: []}
+    for user_id in range(first, first + size):
+        for relation, mean in ((User.favorites, plan['favorites_per_user']),
+                               (User.shopping_cart, plan['carts_per_user'])):
+            rows[relation.through].extend(
+                (user_id, recipe_id) for recipe_id in pick_distinct(
+                    rnd, recipe_ids, pick_count(rnd, mean), plan['alpha']))
+        authors = {get_author(rnd) for _ in range(pick_count(
+            rnd, plan['subscriptions_per_user']))}
+        authors.discard(user_id)
+        rows[Subscription].extend(
+            (user_id, author_id) for author_id in authors)
+    with transaction.atomic():
+        write_rows(User.favorites.through, ('user_id', 'recipe_id'),
+                   rows[User.favorites.through])
+        write_rows(User.shopping_cart.through, ('user_id', 'recipe_id'),
+                   rows[User.shopping_cart.through])
+        write_rows(Subscription, ('subscriber_id', 'author_id'),
+                   rows[Subscription])
+    return sum(map(len, rows.values()))
+
+
+def refresh_users(task):
+    number, start, size = task
+    first = plan['first_user'] + start
+    shopping_list.refresh(range(first, first + size))
+    return size
+
+
+def reset_sequences():
+    '''после вставки с явными id продолжить последовательности с max(id)'''
+    statements = connection.ops.sequence_reset_sql(no_style(), [User, Recipe])
+    with connection.cursor() as cursor:
+        for sql in statements:
+            cursor.execute(sql)
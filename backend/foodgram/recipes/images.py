@@ -0,0 +1,127 @@
+import hashlib
+import io
+import os
+import re
+from collections import namedtuple
+
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from PIL import Image
+
+from recipes.metrics import image_decode_duration
+
+UPLOAD_DIR = 'recipes'
+
+# Размеры и форматы производных картинок рецепта.
+VARIANTS = {
+    'list': {'size': (480, 480), 'format': 'JPEG', 'extension': 'jpg',
+             'options': {'quality': 85, 'optimize': True,
+                         'progressive': True}},
+    'detail': {'size': (1200, 1200), 'format': 'JPEG', 'extension': 'jpg',
+               'options': {'quality': 85, 'optimize': True,
+                           'progressive': True}},
+    'webp': {'size': (1200, 1200), 'format': 'WEBP', 'extension': 'webp',
+             'options': {'quality': 80}},
+}
+
+# Форматы оригиналов, которые принимаются от пользователей, и их
+# расширения. Расширение берётся по содержимому файла, а не из запроса:
+# иначе под видом картинки можно сохранить, например, .html.
+ALLOWED_FORMATS = {'JPEG': 'jpg', 'PNG': 'png', 'GIF': 'gif', 'WEBP': 'webp'}
+
+# Проверенная, но ещё не сохранённая картинка из запроса.
+Upload = namedtuple('Upload', ('content', 'extension'))
+
+HASHED_NAME = re.compile(
+    rf'^{UPLOAD_DIR}/[0-9a-f]{{2}}/[0-9a-f]{{2}}/[0-9a-f]{{64}}\.\w+$')
+
+
+def get_hashed_name(content: bytes, extension: str) -> str:
+    '''имя файла по sha256 содержимого, с разбивкой по префиксу хэша'''
+    digest = hashlib.sha256(content).hexdigest()
+    return f'{UPLOAD_DIR}/{digest[:2]}/{digest[2:4]}/{digest}.{extension}'
+
+
+def get_extension(image) -> str:
+    '''Расширение для открытой картинки PIL или None для
+    недопустимого формата.'''
+    return ALLOWED_FORMATS.get(image.format)
+
+
+def get_variant_name(name: str, variant: str) -> str:
+    base, _ = os.path.splitext(name)
+    return f'{base}_{variant}.{VARIANTS[variant]["extension"]}'
+
+
+def has_variants(name: str) -> bool:
+    '''производные картинки есть только у файлов с именем по хэшу'''
+    return bool(HASHED_NAME.match(name))
+
+
+def get_variant_url(name: str, variant: str) -> str:
+    if has_variants(name):
+        return default_storage.url(get_variant_name(name, variant))
+    return default_storage.url(name)
+
+
+def save_file(name: str, content: bytes) -> None:
+    if default_storage.exists(name):
+        return
+    saved_name = default_storage.save(name, ContentFile(content))
+    if saved_name != name:
+        # Тот же файл параллельно сохранил другой запрос.
+        default_storage.delete(saved_name)
+
+
+def store_original(content: bytes, extension: str) -> str:
+    '''сохранить оригинал под именем по хэшу и вернуть это имя'''
+    name = get_hashed_name(content, extension.lower())
+    save_file(name, content)
+    return name
+
+
+def store_image(content: bytes, extension: str) -> str:
+    '''Сохранить оригинал и производные картинки, вернуть имя оригинала.
+
+    Одинаковые картинки сохраняются один раз.
+    '''
+    name = get_hashed_name(content, extension.lower())
+    if not default_storage.exists(name):
+        save_file(name, content)
+        create_variants(name)
+    return name
+
+
+def variants_exist(name: str) -> bool:
+    return has_variants(name) and all(
+        default_storage.exists(get_variant_name(name, variant))
+        for variant in VARIANTS
+    )
+
+
+def create_variants(name: str) -> None:
+    with image_decode_duration.time(stage='variants'):
+        with default_storage.open(name) as source:
+            image = Image.open(source)
+            image.load()
+    if image.mode in ('RGBA', 'LA', 'P'):
+        image = image.convert('RGBA')
+        background = Image.new('RGB', image.size, (255, 255, 255))
+        background.paste(image, mask=image.getchannel('A'))
+        image = background
+    elif image.mode != 'RGB':
+        image = image.convert('RGB')
+    for variant, spec in VARIANTS.items():
+        resized = image.copy()
+        resized.thumbnail(spec['size'], Image.LANCZOS)
+        buffer = io.BytesIO()
+        resized.save(buffer, spec['format'], **spec['options'])
+        save_file(get_variant_name(name, variant), buffer.getvalue())
+
+
+def delete_image(name: str) -> None:
+    '''удалить оригинал и производные картинки'''
+    default_storage.delete(name)
+    if has_variants(name):
+        for variant in VARIANTS:
+            default_storage.delete(get_variant_name(name, variant))
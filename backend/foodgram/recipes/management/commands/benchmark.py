@@ -0,0 +1,211 @@
+import json
+import platform
+import statistics
+import subprocess
+import time
+from datetime import datetime, timezone
+
+import django
+from django.core.cache import cache
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from recipes import seeding
+
+# (name, path): paths are formatted with ids of seeded objects
+BENCHMARKS = (
+    ('feed', '/api/recipes/?limit=6'),
+    ('feed, page of 50', '/api/recipes/?limit=50'),
+    ('feed, deep page', '/api/recipes/?limit=6&page=10'),
+    ('recipe detail', '/api/recipes/{recipe}/'),
+    ('filter by tag', '/api/recipes/?limit=6&tags={tag}'),
+    ('filter by author', '/api/recipes/?limit=6&author={author}'),
+    ('filter favorited', '/api/recipes/?limit=6&is_favorited=1'),
+    ('filter in shopping cart',
+     '/api/recipes/?limit=6&is_in_shopping_cart=1'),
+    ('search', '/api/recipes/?limit=6&search=рецепт'),
+    ('subscriptions', '/api/users/subscriptions/?limit=6&recipes_limit=3'),
+    ('ingredients autocomplete', '/api/ingredients/?name=ингр'),
+    ('download shopping cart, txt',
+     '/api/recipes/download_shopping_cart/?format=txt'),
+    ('download shopping cart, csv',
+     '/api/recipes/download_shopping_cart/?format=csv'),
+    ('download shopping cart, pdf',
+     '/api/recipes/download_shopping_cart/?format=pdf'),
+)
+
+DATASET_OPTIONS = {
+    'users': 200,
+    'recipes_per_user': 10,
+    'ingredients': 500,
+    'ingredients_per_recipe': 8,
+    'favorites_per_user': 50,
+    'carts_per_user': 10,
+    'subscriptions_per_user': 20,
+    'random_seed': 0,
+}
+
+PERCENTILES = (50, 95, 99)
+
+
+def get_commit():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], capture_output=True,
+            text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def percentile(ordered, p):
+    '''p-й перцентиль отсортированных значений, с интерполяцией между
+    соседними, как statistics.quantiles(method='inclusive')'''
+    position = (len(ordered) - 1) * p / 100
+    lower = int(position)
+    upper = min(lower + 1, len(ordered) - 1)
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (
+        position - lower)
+
+
+def summarize(durations):
+    '''перцентили и среднее в миллисекундах, запросов в секунду'''
+    ordered = sorted(durations)
+    result = {f'p{p}_ms': round(percentile(ordered, p) * 1000, 3)
+              for p in PERCENTILES}
+    result['mean_ms'] = round(statistics.mean(durations) * 1000, 3)
+    result['rps'] = round(len(durations) / sum(durations), 1)
+    return result
+
+
+class Command(BaseCommand):
+    help = ('Seeds a test database with a configurable dataset, measures '
+            'latency percentiles and throughput of the main API endpoints '
+            'and writes the results as JSON to compare between commits.')
+
+    def add_arguments(self, parser):
+        for option, default in DATASET_OPTIONS.items():
+            parser.add_argument(
+                f'--{option.replace("_", "-")}',
+                type=int,
+                default=default,
+                help=f'Dataset size: {option} (default {default}).')
+        parser.add_argument(
+            '--requests',
+            type=int,
+            default=100,
+            help='Measured requests per endpoint.')
+        parser.add_argument(
+            '--warmup',
+            type=int,
+            default=10,
+            help='Requests per endpoint before measuring.')
+        parser.add_argument(
+            '--cold',
+            action='store_true',
+            help='Clear the cache before every request.')
+        parser.add_argument(
+            '--only',
+            nargs='+',
+            metavar='NAME',
+            help='Run only benchmarks whose names contain NAME.')
+        parser.add_argument(
+            '--output',
+            default='benchmark.json',
+            help='Path of the JSON results file, "-" for stdout.')
+        parser.add_argument(
+            '--compare',
+            metavar='PATH',
+            help='Previous results file to print the difference with.')
+
+    def handle(self, *args, **options):
+        if options['requests'] < 2:
+            raise CommandError('--requests must be at least 2')
+        benchmarks = [
+            (name, path) for name, path in BENCHMARKS
+            if not options['only']
+            or any(part in name for part in options['only'])]
+        if not benchmarks:
+            raise CommandError('no benchmarks match --only')
+        dataset = {option: options[option] for option in DATASET_OPTIONS}
+        try:
+            seeding.check_options(**dataset)
+        except ValueError as error:
+            raise CommandError(error)
+        with seeding.test_database():
+            start = time.perf_counter()
+            seeding.seed(**dataset)
+            seed_time = time.perf_counter() - start
+            results = {
+                name: self.run_benchmark(name, path, options)
+                for name, path in benchmarks
+            }
+        report = {
+            'meta': {
+                'commit': get_commit(),
+                'date': datetime.now(timezone.utc).isoformat(
+                    timespec='seconds'),
+                'database': connection.vendor,
+                'python': platform.python_version(),
+                'django': django.get_version(),
+                'requests': options['requests'],
+                'warmup': options['warmup'],
+                'cold_cache': options['cold'],
+                'seed_seconds': round(seed_time, 2),
+            },
+            'dataset': dataset,
+            'results': results,
+        }
+        self.write(report, options['output'])
+        if options['compare']:
+            self.compare(options['compare'], results)
+
+    def run_benchmark(self, name, path, options):
+        context = seeding.get_context()
+        path = path.format(**context)
+        # настоящий заголовок: замеряется и кэш аутентификации
+        token, _ = Token.objects.get_or_create(user=context['viewer'])
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=f'Token {token.key}')
+        for _ in range(options['warmup']):
+            self.request(client, path, options['cold'])
+        durations = [self.request(client, path, options['cold'])
+                     for _ in range(options['requests'])]
+        result = summarize(durations)
+        self.stderr.write(
+            f'{name:<30} '
+            + '  '.join(f'{key} {value:>9}' for key, value in result.items()))
+        return result
+
+    def request(self, client, path, cold):
+        if cold:
+            cache.clear()
+        start = time.perf_counter()
+        response = client.get(path)
+        if response.streaming:
+            b''.join(response.streaming_content)
+        if response.status_code >= 400:
+            raise CommandError(f'GET {path} returned {response.status_code}')
+        return time.perf_counter() - start
+
+    def write(self, report, output):
+        data = json.dumps(report, ensure_ascii=False, indent=2,
+                          sort_keys=True)
+        if output == '-':
+            self.stdout.write(data)
+            return
+        with open(output, 'w') as file:
+            file.write(data + '\n')
+        self.stderr.write(f'Results written to {output}')
+
+    def compare(self, path, results):
+        with open(path) as file:
+            previous = json.load(file)['results']
+        for name, result in results.items():
+            if name not in previous:
+                continue
+            changes = '  '.join(
+                f'{key} {(result[key] / previous[name][key] - 1) * 100:+.0f}%'
+                for key in result if previous[name].get(key))
+            self.stdout.write(f'{name:<30} {changes}')
@@ -0,0 +1,119 @@
+import multiprocessing
+import os
+import time
+from contextlib import contextmanager
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, connections
+
+from recipes import counters, fake_data
+from recipes.models import Ingredient, Tag
+
+
+@contextmanager
+def get_map(workers, plan):
+    '''map по пулу процессов или в текущем процессе при workers == 1'''
+    if workers == 1:
+        fake_data.init_worker(plan)
+        yield map
+        return
+    # forked workers must not share the parent's database connection
+    connections.close_all()
+    context = multiprocessing.get_context('fork')
+    with context.Pool(workers, initializer=fake_data.init_worker,
+                      initargs=(plan,)) as pool:
+        yield pool.imap_unordered
+
+
+class Command(BaseCommand):
+    help = ('Generates users, recipes, favorites, shopping carts and '
+            'subscriptions for load testing: power-law popularity of '
+            'authors, recipes, ingredients and tags, deterministic for a '
+            'given --seed, written with COPY on PostgreSQL by parallel '
+            'workers. Tags and ingredients must already be loaded. Each '
+            'chunk is committed separately.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--users', type=int, default=10000,
+            help='Number of users to create.')
+        parser.add_argument(
+            '--recipes', type=int, default=100000,
+            help='Number of recipes to create.')
+        parser.add_argument(
+            '--ingredients-per-recipe', type=int, default=8,
+            help='Mean number of ingredients in a recipe.')
+        parser.add_argument(
+            '--favorites-per-user', type=int, default=20,
+            help='Mean number of favorite recipes of a user.')
+        parser.add_argument(
+            '--carts-per-user', type=int, default=3,
+            help='Mean number of recipes in a shopping cart.')
+        parser.add_argument(
+            '--subscriptions-per-user', type=int, default=10,
+            help='Mean number of subscriptions of a user.')
+        parser.add_argument(
+            '--alpha', type=float, default=1.2,
+            help='Power-law exponent: higher values mean a smaller set '
+                 'of popular authors, recipes and ingredients.')
+        parser.add_argument(
+            '--days', type=int, default=365,
+            help='Recipes are published over this many past days.')
+        parser.add_argument(
+            '--seed', type=int, default=0,
+            help='Random seed, the same seed gives the same data.')
+        parser.add_argument(
+            '--workers', type=int, default=os.cpu_count(),
+            help='Number of worker processes (always 1 on SQLite).')
+        parser.add_argument(
+            '--chunk-size', type=int, default=5000,
+            help='Users or recipes generated and committed by one task.')
+
+    def handle(self, *args, **options):
+        if options['users'] < 2 or options['recipes'] < 1:
+            raise CommandError('at least 2 users and 1 recipe are needed')
+        ingredient_ids = list(Ingredient.objects.values_list('pk', flat=True))
+        tag_ids = list(Tag.objects.values_list('pk', flat=True))
+        if not ingredient_ids or not tag_ids:
+            raise CommandError('load ingredients and create tags first')
+        workers = options['workers']
+        if connection.vendor == 'sqlite':
+            # SQLite allows a single writer at a time
+            workers = 1
+        plan = fake_data.make_plan(
+            options['users'], options['recipes'], ingredient_ids, tag_ids,
+            ingredients_per_recipe=options['ingredients_per_recipe'],
+            favorites_per_user=options['favorites_per_user'],
+            carts_per_user=options['carts_per_user'],
+            subscriptions_per_user=options['subscriptions_per_user'],
+            alpha=options['alpha'], days=options['days'],
+            random_seed=options['seed'])
+        user_tasks = fake_data.get_tasks(
+            options['users'], options['chunk_size'])
+        recipe_tasks = fake_data.get_tasks(
+            options['recipes'], options['chunk_size'])
+        with get_map(workers, plan) as run:
+            self.run_phase('users', run, fake_data.generate_users,
+                           user_tasks)
+            self.run_phase('recipes, ingredients and tags', run,
+                           fake_data.generate_recipes, recipe_tasks)
+            self.run_phase('favorites, carts and subscriptions', run,
+                           fake_data.generate_relations, user_tasks)
+            fake_data.reset_sequences()
+            start = time.perf_counter()
+            counters.reconcile(fix=True)
+            self.stdout.write(f'counters: '
+                              f'{time.perf_counter() - start:.1f} s')
+            self.run_phase('shopping lists', run, fake_data.refresh_users,
+                           user_tasks)
+        self.stdout.write(self.style.SUCCESS(
+            f'Generated {options["users"]} users and {options["recipes"]} '
+            f'recipes with {workers} workers'))
+
+    def run_phase(self, name, run, function, tasks):
+        start = time.perf_counter()
+        rows = sum(run(function, tasks))
+        duration = time.perf_counter() - start
+        self.stdout.write(
+            f'{name}: {rows} rows in {duration:.1f} s '
+            f'({rows / max(duration, 1e-9):.0f} rows/s)')
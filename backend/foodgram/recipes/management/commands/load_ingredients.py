@@ -1,14 +1,66 @@
 import argparse
+import csv
+import io
 import json
+import os
+import re
+import time
 
 from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
 
 from recipes.models import Ingredient
+from recipes.versions import bump_model_version
+
+# Whitespace and commas between elements of a JSON array.
+SEPARATOR = re.compile(r'\s*,*\s*')
+
+
+def iter_json_array(source, chunk_size=64 * 1024):
+    '''Объекты JSON-массива по одному, без чтения всего файла в память.
+
+    Разбор идёт по позиции в буфере; прочитанное начало буфера
+    отбрасывается только при чтении следующего куска, а не после
+    каждого объекта.
+    '''
+    decoder = json.JSONDecoder()
+    buffer = source.read(chunk_size).lstrip()
+    if not buffer.startswith('['):
+        raise CommandError('failed to load json file: array expected')
+    position = 1
+    while True:
+        position = SEPARATOR.match(buffer, position).end()
+        if buffer.startswith(']', position):
+            return
+        try:
+            item, position = decoder.raw_decode(buffer, position)
+        except json.JSONDecodeError as error:
+            chunk = source.read(chunk_size)
+            if not chunk:
+                raise CommandError(f'failed to load json file: {error}')
+            buffer, position = buffer[position:] + chunk, 0
+            continue
+        yield item
+        if len(buffer) - position < chunk_size:
+            buffer, position = buffer[position:] + source.read(chunk_size), 0
+
+
+def iter_json(source):
+    for item in iter_json_array(source):
+        yield item['name'], item['measurement_unit']
+
+
+def iter_csv(source):
+    for row in csv.reader(source):
+        if row:
+            name, measurement_unit = row
+            yield name, measurement_unit
 
 
 class Command(BaseCommand):
-    help = ('Loads ingredients list from .json file.'
-            '"name" and "measurement_unit" keys are required.')
+    help = ('Loads ingredients list from .json or .csv file. '
+            'JSON: array of objects with "name" and "measurement_unit" '
+            'keys. CSV: "name,measurement_unit" rows without header.')
 
     def add_arguments(self, parser):
         parser.add_argument(
@@ -16,33 +68,85 @@ class Command(BaseCommand):
             nargs='?',
             type=argparse.FileType('r', encoding='UTF-8'),
             default='./data/ingredients.json',
-            help='Path to .json file with data, if empty default will be '
-                 'used: /data/ingredients.json')
+            help='Path to .json or .csv file with data, if empty default '
+                 'will be used: /data/ingredients.json')
+        parser.add_argument(
+            '--format',
+            choices=['json', 'csv'],
+            help='File format, detected by extension if not set.')
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=5000,
+            help='Number of ingredients inserted at once.')
 
     def handle(self, *args, **options):
+        source = options['path_to_data_file']
+        file_format = options['format'] or os.path.splitext(
+            source.name)[1].lstrip('.').lower()
+        if file_format not in ('json', 'csv'):
+            raise CommandError(f'unknown file format: {file_format}')
         self.stdout.write(
-            'Trying to load ingredients list from '
-            f'{options["path_to_data_file"].name}'
-        )
-        with options['path_to_data_file'] as source:
-            try:
-                data = json.load(source)
-                add_counter = 0
-                for ingredient in data:
-                    if not Ingredient.objects.filter(
-                            name=ingredient['name']).exists():
-                        Ingredient(
-                            name=ingredient['name'],
-                            measurement_unit=ingredient[
-                                'measurement_unit']).save()
-                        add_counter += 1
-            except json.decoder.JSONDecodeError as error:
-                raise CommandError(f'failed to load json file: {error}')
-            except KeyError:
-                raise CommandError('wrong data in file')
-            except Exception as error:
-                raise CommandError(
-                    f'something went wrong {type(error)}: {error}'
-                )
+            f'Trying to load ingredients list from {source.name}')
+        started = time.monotonic()
+        rows = iter_json(source) if file_format == 'json' else iter_csv(source)
+        insert = (self.copy_batch if connection.vendor == 'postgresql'
+                  else self.create_batch)
+        try:
+            with source, transaction.atomic():
+                add_counter = self.load(rows, insert, options['batch_size'],
+                                        started)
+                if add_counter:
+                    # committed together with the rows: other processes
+                    # rebuild the autocomplete index and catalog cache
+                    bump_model_version(Ingredient)
+        except CommandError:
+            raise
+        except (KeyError, TypeError, ValueError):
+            raise CommandError('wrong data in file')
+        except Exception as error:
+            raise CommandError(
+                f'something went wrong {type(error)}: {error}'
+            )
         self.stdout.write(self.style.SUCCESS(
-            f'Successfully added {add_counter} new inrgedients'))
+            f'Successfully added {add_counter} new inrgedients '
+            f'in {time.monotonic() - started:.2f}s'))
+
+    def load(self, rows, insert, batch_size, started):
+        known_names = set(Ingredient.objects.values_list('name', flat=True))
+        add_counter = 0
+        batch = []
+        for name, measurement_unit in rows:
+            if name in known_names:
+                continue
+            known_names.add(name)
+            batch.append((name, measurement_unit))
+            if len(batch) >= batch_size:
+                add_counter += insert(batch)
+                batch = []
+                self.stdout.write(
+                    f'  {add_counter} added, '
+                    f'{time.monotonic() - started:.2f}s')
+        if batch:
+            add_counter += insert(batch)
+        return add_counter
+
+    def create_batch(self, batch):
+        Ingredient.objects.bulk_create(
+            [Ingredient(name=name, measurement_unit=measurement_unit)
+             for name, measurement_unit in batch],
+            ignore_conflicts=True,
+        )
+        return len(batch)
+
+    def copy_batch(self, batch):
+        buffer = io.StringIO()
+        csv.writer(buffer).writerows(batch)
+        buffer.seek(0)
+        table = connection.ops.quote_name(Ingredient._meta.db_table)
+        with connection.cursor() as cursor:
+            cursor.copy_expert(
+                f'COPY {table} (name, measurement_unit) FROM STDIN WITH CSV',
+                buffer,
+            )
+        return len(batch)
@@ -0,0 +1,44 @@
+import io
+
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand
+from PIL import Image
+
+from recipes import images
+from recipes.models import Recipe
+
+
+class Command(BaseCommand):
+    help = ('Moves recipe images stored under upload names to content '
+            'addressed names, creates resized variants and removes '
+            'duplicate files.')
+
+    def handle(self, *args, **options):
+        moved = removed = 0
+        legacy_names = (
+            Recipe.objects
+            .exclude(image__regex=images.HASHED_NAME.pattern)
+            .values_list('image', flat=True)
+            .distinct()
+        )
+        for name in list(legacy_names):
+            if not default_storage.exists(name):
+                self.stderr.write(f'Missing file {name}, skipped')
+                continue
+            with default_storage.open(name) as source:
+                content = source.read()
+            try:
+                extension = images.get_extension(
+                    Image.open(io.BytesIO(content)))
+            except Exception:
+                extension = None
+            if extension is None:
+                self.stderr.write(f'Not an allowed image {name}, skipped')
+                continue
+            hashed_name = images.store_image(content, extension)
+            moved += Recipe.objects.filter(image=name).touch(
+                image=hashed_name)
+            default_storage.delete(name)
+            removed += 1
+        self.stdout.write(self.style.SUCCESS(
+            f'Updated {moved} recipes, removed {removed} legacy files'))
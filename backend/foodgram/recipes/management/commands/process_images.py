@@ -0,0 +1,121 @@
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from recipes import images, tasks
+from recipes.metrics import registry
+
+
+def create_variants(name):
+    # процессы пула завершаются без atexit, метрики пишутся сразу
+    try:
+        images.create_variants(name)
+    finally:
+        registry.flush()
+
+
+class Command(BaseCommand):
+    help = ('Processes uploaded recipe images from the database queue: '
+            'validates them and creates resized variants in a pool of '
+            'worker processes.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=os.cpu_count() or 1,
+            help='Number of worker processes.')
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=20,
+            help='Number of tasks taken from the queue at once.')
+        parser.add_argument(
+            '--sleep',
+            type=float,
+            default=1.0,
+            help='Seconds to wait when the queue is empty.')
+        parser.add_argument(
+            '--once',
+            action='store_true',
+            help='Exit when the queue is empty instead of waiting.')
+
+    def handle(self, *args, **options):
+        self.workers = options['workers']
+        self.pool = None
+        try:
+            while True:
+                batch = tasks.claim_tasks(options['batch_size'])
+                if not batch:
+                    if options['once']:
+                        break
+                    time.sleep(options['sleep'])
+                    continue
+                self.process(batch)
+        finally:
+            if self.pool is not None:
+                self.pool.shutdown()
+
+    def get_pool(self):
+        if self.pool is None:
+            # Соединения с базой не должны наследоваться дочерними
+            # процессами.
+            connections.close_all()
+            self.pool = ProcessPoolExecutor(max_workers=self.workers)
+        return self.pool
+
+    def process(self, batch):
+        '''Обработать задачи пачки.
+
+        Если дочерний процесс упал (нехватка памяти, сбой Pillow), пул
+        пересоздаётся, а незавершённые задачи запускаются по одной: без
+        этого все следующие задачи тоже падали бы и тратили попытки.
+        Попытка засчитывается только задаче, которая роняет процесс
+        сама по себе.
+        '''
+        broken = self.run(batch)
+        if len(batch) > 1:
+            broken = [task for alone in broken for task in self.run([alone])]
+        for task in broken:
+            self.fail(task, 'BrokenProcessPool: worker process died')
+
+    def run(self, batch):
+        '''выполнить задачи, вернуть те, что не доработали из-за
+        падения процесса пула'''
+        pool = self.get_pool()
+        futures = {
+            pool.submit(create_variants, task.image): task
+            for task in batch
+        }
+        broken = []
+        for future in as_completed(futures):
+            task = futures[future]
+            try:
+                future.result()
+            except BrokenProcessPool:
+                broken.append(task)
+            except Exception as error:
+                self.fail(task, f'{type(error).__name__}: {error}')
+            else:
+                tasks.complete_task(task)
+                self.stdout.write(f'{task.image} processed')
+        if broken:
+            self.stderr.write(self.style.WARNING(
+                f'Worker process died, restarting the pool for '
+                f'{len(broken)} tasks'))
+            pool.shutdown()
+            self.pool = None
+        return broken
+
+    def fail(self, task, message):
+        if tasks.fail_task(task, message):
+            self.stderr.write(self.style.ERROR(
+                f'{task.image} failed: {message}'))
+        else:
+            self.stderr.write(self.style.WARNING(
+                f'{task.image} attempt {task.attempts} failed, '
+                f'will retry: {message}'))
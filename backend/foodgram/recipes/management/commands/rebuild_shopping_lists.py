@@ -0,0 +1,52 @@
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Q
+
+from recipes import shopping_list
+
+User = get_user_model()
+
+
+class Command(BaseCommand):
+    help = ('Rebuilds aggregated shopping lists from users shopping carts. '
+            'With --check only reports users whose lists are out of sync.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--check',
+            action='store_true',
+            help='Do not change anything, exit with error on mismatch.')
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=500,
+            help='Number of users processed in one transaction.')
+
+    def handle(self, *args, **options):
+        user_ids = list(
+            User.objects
+            .filter(Q(shopping_cart__isnull=False)
+                    | Q(shopping_list_items__isnull=False))
+            .order_by('pk')
+            .values_list('pk', flat=True)
+            .distinct()
+        )
+        batch_size = options['batch_size']
+        out_of_sync = 0
+        for start in range(0, len(user_ids), batch_size):
+            batch = user_ids[start:start + batch_size]
+            if options['check']:
+                changes = shopping_list.get_changes(batch)
+                out_of_sync += len({
+                    item.user_id for items in changes for item in items})
+            else:
+                shopping_list.refresh(batch)
+        if options['check']:
+            if out_of_sync:
+                raise CommandError(
+                    f'{out_of_sync} shopping lists are out of sync')
+            self.stdout.write(self.style.SUCCESS(
+                f'All {len(user_ids)} shopping lists are in sync'))
+            return
+        self.stdout.write(self.style.SUCCESS(
+            f'Rebuilt {len(user_ids)} shopping lists'))
@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from recipes.counters import reconcile
+
+
+class Command(BaseCommand):
+    help = ('Checks denormalized counters (favorites, carts, recipes, '
+            'subscribers) against actual data and repairs drift.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--check',
+            action='store_true',
+            help='Only report drift, exit with error if any is found.')
+
+    def handle(self, *args, **options):
+        drift = reconcile(fix=not options['check'])
+        for counter, rows in drift.items():
+            self.stdout.write(f'{counter}: {rows} rows out of sync')
+        if options['check'] and any(drift.values()):
+            raise CommandError('counters are out of sync')
+        self.stdout.write(self.style.SUCCESS('Counters are in sync'))
@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from recipes import search
+from recipes.models import Recipe
+
+
+class Command(BaseCommand):
+    help = 'Rebuilds full-text search vectors of all recipes (PostgreSQL).'
+
+    def handle(self, *args, **options):
+        if not search.is_supported():
+            self.stdout.write('Full-text search requires PostgreSQL, skipped')
+            return
+        search.update_search_vectors(Recipe.objects.all())
+        self.stdout.write(self.style.SUCCESS('Search vectors rebuilt'))
@@ -0,0 +1,289 @@
+import atexit
+import fcntl
+import json
+import os
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_BUCKETS = (1, 2, 3, 5, 10, 20, 50, 100, 250)
+
+
+class Registry:
+    '''Счётчики и гистограммы, общие для всех процессов.
+
+    Каждый процесс копит значения в памяти и не чаще раза
+    в METRICS_FLUSH_INTERVAL секунд записывает их в свой файл
+    METRICS_DIR/<pid>-<время запуска>.json и всё время работы держит
+    блокировку одноимённого .lock-файла. При выгрузке файлы всех
+    процессов суммируются, а файлы завершившихся процессов (их
+    блокировка свободна) переносятся в общий итог dead.json, чтобы
+    счётчики не уменьшались. Блокировки видны и процессам других
+    контейнеров с тем же каталогом, в отличие от проверки pid.
+    '''
+
+    def __init__(self):
+        self.metrics = {}
+        self.values = {}
+        self.lock = threading.Lock()
+        self.flushed = 0.0
+        self.owner = None
+
+    def reset(self):
+        '''дочерний процесс начинает со своих значений, а не копии родителя'''
+        if self.owner is not None:
+            # закрыть унаследованную копию: блокировка остаётся у родителя
+            self.owner[2].close()
+        self.values = {}
+        self.lock = threading.Lock()
+        self.flushed = 0.0
+        self.owner = None
+
+    def register(self, metric):
+        self.metrics[metric.name] = metric
+        return metric
+
+    @property
+    def directory(self):
+        return settings.METRICS_DIR
+
+    def add(self, key, update):
+        with self.lock:
+            self.values[key] = update(self.values.get(key))
+        if time.monotonic() - self.flushed >= settings.METRICS_FLUSH_INTERVAL:
+            self.flush()
+
+    def get_path(self):
+        '''файл текущего процесса, при первом вызове - его блокировка'''
+        directory = self.directory
+        if self.owner is None or self.owner[0] != directory:
+            os.makedirs(directory, exist_ok=True)
+            name = f'{os.getpid()}-{time.time_ns()}'
+            # сборщик не должен увидеть файл до того, как он заблокирован
+            with self.lock_directory():
+                lock_file = open(os.path.join(directory, f'{name}.lock'), 'w')
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+            self.owner = (directory, name, lock_file)
+        return os.path.join(directory, f'{self.owner[1]}.json')
+
+    def flush(self):
+        with self.lock:
+            data = [[*key, value] for key, value in self.values.items()]
+            self.flushed = time.monotonic()
+        self.write(self.get_path(), data)
+
+    def flush_at_exit(self):
+        '''записать значения, накопленные после последней выгрузки'''
+        if self.values:
+            self.flush()
+
+    def write(self, path, data):
+        with tempfile.NamedTemporaryFile(
+                'w', dir=self.directory, suffix='.tmp',
+                delete=False) as file:
+            json.dump(data, file)
+        os.replace(file.name, path)
+
+    @staticmethod
+    def read(path):
+        try:
+            with open(path) as file:
+                return json.load(file)
+        except (OSError, ValueError):
+            return []
+
+    def merge(self, totals, data):
+        for name, labels, value in data:
+            metric = self.metrics.get(name)
+            if metric is not None:
+                key = (name, tuple(map(tuple, labels)))
+                totals[key] = metric.merge(totals.get(key), value)
+        return totals
+
+    @contextmanager
+    def lock_directory(self):
+        '''один сборщик за раз: перенос в dead.json не должен считаться
+        дважды'''
+        with open(os.path.join(self.directory, 'collect.lock'), 'w') as file:
+            fcntl.flock(file, fcntl.LOCK_EX)
+            yield
+
+    def get_live(self):
+        '''имена файлов работающих процессов: их блокировка занята'''
+        live = set()
+        for filename in os.listdir(self.directory):
+            name, ext = os.path.splitext(filename)
+            if ext != '.lock' or name == 'collect':
+                continue
+            with open(os.path.join(self.directory, filename), 'a') as file:
+                try:
+                    fcntl.flock(file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    live.add(name)
+        return live
+
+    def get_dead(self):
+        '''имена файлов завершившихся процессов и старых файлов без
+        блокировки'''
+        live = self.get_live()
+        return {os.path.splitext(filename)[0]
+                for filename in os.listdir(self.directory)
+                if filename.endswith(('.json', '.lock'))} - live - {
+                    'collect', 'dead'}
+
+    def remove(self, name):
+        for ext in ('.json', '.lock'):
+            try:
+                os.remove(os.path.join(self.directory, name + ext))
+            except FileNotFoundError:
+                pass
+
+    def fold_dead(self):
+        '''перенести значения завершившихся процессов в dead.json'''
+        dead = self.get_dead()
+        if not dead:
+            return
+        path = os.path.join(self.directory, 'dead.json')
+        totals = self.merge({}, self.read(path))
+        for name in dead:
+            self.merge(totals, self.read(
+                os.path.join(self.directory, f'{name}.json')))
+        self.write(path, [[name, labels, value]
+                          for (name, labels), value in totals.items()])
+        for name in dead:
+            self.remove(name)
+
+    def clear(self):
+        '''удалить итоги и файлы завершившихся процессов: вызывается
+        при запуске сервера, файлы работающих процессов остаются'''
+        os.makedirs(self.directory, exist_ok=True)
+        with self.lock_directory():
+            for name in self.get_dead() | {'dead'}:
+                self.remove(name)
+
+    def collect(self):
+        '''значения метрик, просуммированные по файлам процессов'''
+        self.flush()
+        with self.lock_directory():
+            self.fold_dead()
+            totals = {}
+            for filename in os.listdir(self.directory):
+                if filename.endswith('.json'):
+                    self.merge(totals, self.read(
+                        os.path.join(self.directory, filename)))
+        return totals
+
+    def render(self):
+        '''метрики в текстовом формате Prometheus'''
+        totals = self.collect()
+        lines = []
+        for name, metric in sorted(self.metrics.items()):
+            lines.append(f'# HELP {name} {metric.description}')
+            lines.append(f'# TYPE {name} {metric.type}')
+            for (total_name, labels), value in sorted(totals.items()):
+                if total_name == name:
+                    lines.extend(metric.render(dict(labels), value))
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+os.register_at_fork(after_in_child=registry.reset)
+# add() выгружает значения не чаще METRICS_FLUSH_INTERVAL, последние
+# изменения перед выходом иначе потерялись бы
+atexit.register(registry.flush_at_exit)
+
+
+def format_labels(labels):
+    if not labels:
+        return ''
+    pairs = ','.join(
+        '{}="{}"'.format(
+            name, str(value).replace('\\', r'\\').replace('"', r'\"'))
+        for name, value in labels.items())
+    return f'{{{pairs}}}'
+
+
+class Counter:
+    type = 'counter'
+
+    def __init__(self, name, description):
+        self.name = name
+        self.description = description
+        registry.register(self)
+
+    def inc(self, value=1, **labels):
+        registry.add((self.name, tuple(sorted(labels.items()))),
+                     lambda total: (total or 0) + value)
+
+    def merge(self, total, value):
+        return (total or 0) + value
+
+    def render(self, labels, value):
+        yield f'{self.name}{format_labels(labels)} {value}'
+
+
+class Histogram:
+    type = 'histogram'
+
+    def __init__(self, name, description, buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.description = description
+        self.buckets = buckets
+        registry.register(self)
+
+    def observe(self, value, **labels):
+        def update(total):
+            counts, total_sum, total_count = total or (
+                [0] * len(self.buckets), 0, 0)
+            counts = [count + (value <= bound)
+                      for count, bound in zip(counts, self.buckets)]
+            return [counts, total_sum + value, total_count + 1]
+        registry.add((self.name, tuple(sorted(labels.items()))), update)
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def merge(self, total, value):
+        if total is None:
+            return value
+        return [[a + b for a, b in zip(total[0], value[0])],
+                total[1] + value[1], total[2] + value[2]]
+
+    def render(self, labels, value):
+        counts, total_sum, total_count = value
+        for bound, count in [*zip(self.buckets, counts),
+                             ('+Inf', total_count)]:
+            bucket_labels = format_labels({**labels, 'le': bound})
+            yield f'{self.name}_bucket{bucket_labels} {count}'
+        yield f'{self.name}_sum{format_labels(labels)} {total_sum}'
+        yield f'{self.name}_count{format_labels(labels)} {total_count}'
+
+
+request_duration = Histogram(
+    'foodgram_http_request_duration_seconds',
+    'API request latency by view action.')
+request_queries = Histogram(
+    'foodgram_http_request_queries',
+    'SQL queries per sampled API request by view action.',
+    buckets=QUERY_BUCKETS)
+db_queries = Counter(
+    'foodgram_db_queries_total',
+    'SQL queries of sampled API requests by view action.')
+export_duration = Histogram(
+    'foodgram_shopping_list_export_seconds',
+    'Time to stream a shopping list export by format.')
+image_decode_duration = Histogram(
+    'foodgram_image_decode_seconds',
+    'Time to decode an uploaded image by stage.')
+cache_requests = Counter(
+    'foodgram_cache_requests_total',
+    'Cache lookups by cache and result.')
@@ -0,0 +1,18 @@
+# Generated by Django 3.2 on 2026-10-18 20:27
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0012_hot_path_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipe',
+            name='version',
+            field=models.BigIntegerField(default=0, editable=False, verbose_name='Версия'),
+        ),
+    ]
@@ -0,0 +1,35 @@
+# Generated by Django 3.2 on 2026-10-18 20:50
+
+import time
+
+from django.db import migrations, models
+
+
+def create_versions(apps, schema_editor):
+    ModelVersion = apps.get_model('recipes', 'ModelVersion')
+    ModelVersion.objects.bulk_create(
+        [ModelVersion(label=label, version=time.time_ns())
+         for label in ('recipes.ingredient', 'recipes.tag')],
+        ignore_conflicts=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0013_recipe_version'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ModelVersion',
+            fields=[
+                ('label', models.CharField(max_length=100, primary_key=True, serialize=False, verbose_name='Модель')),
+                ('version', models.BigIntegerField(default=0, verbose_name='Версия')),
+            ],
+            options={
+                'verbose_name': 'Версия данных',
+                'verbose_name_plural': 'Версии данных',
+            },
+        ),
+        migrations.RunPython(create_versions, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,135 @@
+from django.db import migrations
+
+# search_vector is kept up to date by the database itself, so bulk
+# inserts, COPY, admin edits and ingredient renames are all covered.
+# The expression matches recipes.search.get_search_vector().
+CREATE_TRIGGERS = '''
+CREATE FUNCTION recipes_search_vector(bigint, text, text)
+RETURNS tsvector LANGUAGE sql STABLE AS $$
+    SELECT setweight(to_tsvector('russian', coalesce($2, '')), 'A')
+        || setweight(to_tsvector('russian', coalesce($3, '')), 'B')
+        || setweight(to_tsvector('russian', coalesce((
+            SELECT string_agg(i.name, ' ')
+            FROM recipes_ingredientamount a
+            JOIN recipes_ingredient i ON i.id = a.ingredient_id
+            WHERE a.recipe_id = $1), '')), 'C')
+$$;
+
+CREATE FUNCTION recipes_refresh_search_vectors(bigint[])
+RETURNS void LANGUAGE sql AS $$
+    UPDATE recipes_recipe
+    SET search_vector = recipes_search_vector(id, name, text)
+    WHERE id = ANY($1)
+$$;
+
+CREATE FUNCTION recipes_recipe_search_vector() RETURNS trigger
+LANGUAGE plpgsql AS $$
+BEGIN
+    NEW.search_vector := recipes_search_vector(NEW.id, NEW.name, NEW.text);
+    RETURN NEW;
+END
+$$;
+
+CREATE TRIGGER recipe_search_vector_insert
+BEFORE INSERT ON recipes_recipe
+FOR EACH ROW EXECUTE FUNCTION recipes_recipe_search_vector();
+
+CREATE TRIGGER recipe_search_vector_update
+BEFORE UPDATE OF name, text ON recipes_recipe
+FOR EACH ROW
+WHEN (OLD.name IS DISTINCT FROM NEW.name
+      OR OLD.text IS DISTINCT FROM NEW.text)
+EXECUTE FUNCTION recipes_recipe_search_vector();
+
+CREATE FUNCTION recipes_amount_search_vector() RETURNS trigger
+LANGUAGE plpgsql AS $$
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        PERFORM recipes_refresh_search_vectors(
+            ARRAY(SELECT DISTINCT recipe_id FROM new_rows)::bigint[]);
+    ELSIF TG_OP = 'DELETE' THEN
+        PERFORM recipes_refresh_search_vectors(
+            ARRAY(SELECT DISTINCT recipe_id FROM old_rows)::bigint[]);
+    ELSE
+        PERFORM recipes_refresh_search_vectors(ARRAY(
+            SELECT n.recipe_id FROM new_rows n JOIN old_rows o USING (id)
+            WHERE n.recipe_id <> o.recipe_id
+                OR n.ingredient_id <> o.ingredient_id
+            UNION
+            SELECT o.recipe_id FROM new_rows n JOIN old_rows o USING (id)
+            WHERE n.recipe_id <> o.recipe_id
+                OR n.ingredient_id <> o.ingredient_id)::bigint[]);
+    END IF;
+    RETURN NULL;
+END
+$$;
+
+CREATE TRIGGER ingredientamount_search_vector_insert
+AFTER INSERT ON recipes_ingredientamount
+REFERENCING NEW TABLE AS new_rows
+FOR EACH STATEMENT EXECUTE FUNCTION recipes_amount_search_vector();
+
+CREATE TRIGGER ingredientamount_search_vector_update
+AFTER UPDATE ON recipes_ingredientamount
+REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+FOR EACH STATEMENT EXECUTE FUNCTION recipes_amount_search_vector();
+
+CREATE TRIGGER ingredientamount_search_vector_delete
+AFTER DELETE ON recipes_ingredientamount
+REFERENCING OLD TABLE AS old_rows
+FOR EACH STATEMENT EXECUTE FUNCTION recipes_amount_search_vector();
+
+CREATE FUNCTION recipes_ingredient_search_vector() RETURNS trigger
+LANGUAGE plpgsql AS $$
+BEGIN
+    PERFORM recipes_refresh_search_vectors(ARRAY(
+        SELECT DISTINCT a.recipe_id
+        FROM new_rows n
+        JOIN old_rows o USING (id)
+        JOIN recipes_ingredientamount a ON a.ingredient_id = n.id
+        WHERE n.name IS DISTINCT FROM o.name)::bigint[]);
+    RETURN NULL;
+END
+$$;
+
+CREATE TRIGGER ingredient_search_vector_update
+AFTER UPDATE ON recipes_ingredient
+REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+FOR EACH STATEMENT EXECUTE FUNCTION recipes_ingredient_search_vector();
+'''
+
+DROP_TRIGGERS = '''
+DROP TRIGGER ingredient_search_vector_update ON recipes_ingredient;
+DROP TRIGGER ingredientamount_search_vector_delete
+    ON recipes_ingredientamount;
+DROP TRIGGER ingredientamount_search_vector_update
+    ON recipes_ingredientamount;
+DROP TRIGGER ingredientamount_search_vector_insert
+    ON recipes_ingredientamount;
+DROP TRIGGER recipe_search_vector_update ON recipes_recipe;
+DROP TRIGGER recipe_search_vector_insert ON recipes_recipe;
+DROP FUNCTION recipes_ingredient_search_vector();
+DROP FUNCTION recipes_amount_search_vector();
+DROP FUNCTION recipes_recipe_search_vector();
+DROP FUNCTION recipes_refresh_search_vectors(bigint[]);
+DROP FUNCTION recipes_search_vector(bigint, text, text);
+'''
+
+
+def run_on_postgresql(sql):
+    def run(apps, schema_editor):
+        if schema_editor.connection.vendor == 'postgresql':
+            schema_editor.execute(sql)
+    return run
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0014_modelversion'),
+    ]
+
+    operations = [
+        migrations.RunPython(run_on_postgresql(CREATE_TRIGGERS),
+                             run_on_postgresql(DROP_TRIGGERS)),
+    ]
@@ -1,10 +1,17 @@
+import time
+
 from django.contrib.auth import get_user_model
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import SearchVectorField
 from django.core.validators import (MaxValueValidator, MinValueValidator,
                                     RegexValidator)
 from django.db import models
+from django.db.models.functions import RowNumber
+from django.utils import timezone
 from django.utils.text import slugify
 
-from recipes.utils import transliterate
+from recipes.utils import get_update_fields, transliterate
+from users.models import Subscription
 
 User = get_user_model()
 
@@ -55,6 +62,70 @@ class Tag(models.Model):
         return str(self.name)
 
 
+class ImageStatus(models.TextChoices):
+    PENDING = 'pending', 'Обрабатывается'
+    READY = 'ready', 'Готова'
+    FAILED = 'failed', 'Ошибка обработки'
+
+
+class RecipeQuerySet(models.QuerySet):
+    def with_user_flags(self, user):
+        '''is_favorited, is_in_shopping_cart и подписка на автора
+        одним запросом через EXISTS-подзапросы. search_vector для
+        вывода не нужен и не загружается.'''
+        queryset = self.defer('search_vector')
+        if not user.is_authenticated:
+            return queryset.annotate(
+                is_favorited=models.Value(
+                    False, output_field=models.BooleanField()),
+                is_in_shopping_cart=models.Value(
+                    False, output_field=models.BooleanField()),
+                author_is_subscribed=models.Value(
+                    False, output_field=models.BooleanField()),
+            )
+        return queryset.annotate(
+            is_favorited=models.Exists(
+                User.favorites.through.objects.filter(
+                    user=user, recipe=models.OuterRef('pk'))),
+            is_in_shopping_cart=models.Exists(
+                User.shopping_cart.through.objects.filter(
+                    user=user, recipe=models.OuterRef('pk'))),
+            author_is_subscribed=models.Exists(
+                Subscription.objects.filter(
+                    subscriber=user, author=models.OuterRef('author'))),
+        )
+
+    @staticmethod
+    def get_relations():
+        return (
+            'tags',
+            models.Prefetch(
+                'amounts',
+                queryset=IngredientAmount.objects.select_related(
+                    'ingredient')),
+        )
+
+    def latest_by_author(self, limit):
+        '''Не больше limit последних рецептов каждого автора.
+
+        Номер рецепта у автора считает ROW_NUMBER() за один проход по
+        индексу (author, -pub_date, -id). Django 3.2 не фильтрует по
+        оконным функциям, поэтому запрос оборачивается в SELECT вручную;
+        результат - RawQuerySet, по авторам и от новых к старым.
+        '''
+        ranked = self.annotate(row_number=models.Window(
+            RowNumber(), partition_by=[models.F('author')],
+            order_by=[models.F('pub_date').desc(), models.F('id').desc()]))
+        sql, params = ranked.query.sql_with_params()
+        return self.model.objects.raw(
+            f'SELECT * FROM ({sql}) ranked WHERE row_number <= %s '
+            f'ORDER BY author_id, row_number', (*params, limit))
+
+    def touch(self, **fields):
+        '''обновить поля рецептов и сменить их версию'''
+        return self.update(version=time.time_ns(), **fields)
+
+
 class Recipe(models.Model):
     author = models.ForeignKey(
         User, on_delete=models.CASCADE,
@@ -77,6 +148,12 @@ class Recipe(models.Model):
         null=False,
         blank=False,
         verbose_name='Картинка')
+    image_status = models.CharField(
+        max_length=10,
+        choices=ImageStatus.choices,
+        default=ImageStatus.READY,
+        editable=False,
+        verbose_name='Состояние картинки')
     text = models.TextField(
         null=False,
         blank=False,
@@ -100,12 +177,55 @@ class Recipe(models.Model):
     pub_date = models.DateTimeField(
         auto_now_add=True,
         verbose_name='Дата публикации')
+    favorites_count = models.PositiveIntegerField(
+        default=0,
+        editable=False,
+        verbose_name='Добавлений в избранное')
+    in_carts_count = models.PositiveIntegerField(
+        default=0,
+        editable=False,
+        verbose_name='Добавлений в список покупок')
+    search_vector = SearchVectorField(
+        null=True,
+        editable=False,
+        verbose_name='Поисковый вектор')
+    version = models.BigIntegerField(
+        default=0,
+        editable=False,
+        verbose_name='Версия')
+
+    objects = RecipeQuerySet.as_manager()
+
+    # счётчики меняются через F(), search_vector - триггерами в базе
+    COMPUTED_FIELDS = ('favorites_count', 'in_carts_count', 'search_vector')
 
     class Meta:
         ordering = ('-pub_date',)
+        indexes = [
+            models.Index(fields=['-pub_date', '-id'],
+                         name='recipe_pub_date_id_idx'),
+            models.Index(fields=['author', '-pub_date', '-id'],
+                         name='recipe_author_pub_date_idx'),
+            GinIndex(fields=['search_vector'],
+                     name='recipe_search_vector_idx'),
+        ]
         verbose_name = 'Рецепт'
         verbose_name_plural = 'Рецепты'
 
+    def save(self, *args, **kwargs):
+        '''Сохранить рецепт и сменить его версию.
+
+        Полное сохранение существующего рецепта не записывает
+        COMPUTED_FIELDS: в загруженном ранее объекте они могут устареть.
+        '''
+        self.version = time.time_ns()
+        update_fields = kwargs.get('update_fields')
+        if update_fields is None and not self._state.adding:
+            update_fields = get_update_fields(self, self.COMPUTED_FIELDS)
+        if update_fields is not None:
+            kwargs['update_fields'] = {*update_fields, 'version'}
+        super().save(*args, **kwargs)
+
     def __str__(self):
         return self.name
 
@@ -134,3 +254,78 @@ class IngredientAmount(models.Model):
 
     def __str__(self):
         return str(self.id)
+
+
+class ShoppingListItem(models.Model):
+    '''Итоговое количество ингредиента в списке покупок пользователя.
+
+    Агрегат по рецептам из корзины, поддерживается модулем
+    recipes.shopping_list.
+    '''
+    user = models.ForeignKey(User, on_delete=models.CASCADE,
+                             related_name='shopping_list_items',
+                             verbose_name='Пользователь')
+    ingredient = models.ForeignKey(Ingredient, on_delete=models.CASCADE,
+                                   verbose_name='Ингредиент')
+    amount = models.PositiveIntegerField(verbose_name='Количество')
+
+    class Meta:
+        verbose_name = 'Позиция списка покупок'
+        verbose_name_plural = 'Списки покупок'
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'ingredient'],
+                                    name='unique_shopping_list_item'),
+        ]
+
+    def __str__(self):
+        return f'{self.ingredient} - {self.amount}'
+
+
+class ImageTask(models.Model):
+    '''Задача на обработку загруженной картинки (см. recipes.tasks).'''
+
+    class Status(models.TextChoices):
+        PENDING = 'pending', 'В очереди'
+        PROCESSING = 'processing', 'Выполняется'
+        DONE = 'done', 'Выполнена'
+        FAILED = 'failed', 'Ошибка'
+
+    image = models.CharField(max_length=255, unique=True,
+                             verbose_name='Файл')
+    status = models.CharField(max_length=10, choices=Status.choices,
+                              default=Status.PENDING,
+                              verbose_name='Состояние')
+    attempts = models.PositiveSmallIntegerField(default=0,
+                                                verbose_name='Попыток')
+    error = models.TextField(blank=True, verbose_name='Ошибка')
+    run_after = models.DateTimeField(default=timezone.now,
+                                     verbose_name='Не раньше')
+    updated = models.DateTimeField(auto_now=True, verbose_name='Изменена')
+
+    class Meta:
+        verbose_name = 'Обработка картинки'
+        verbose_name_plural = 'Обработка картинок'
+        indexes = [
+            models.Index(fields=['status', 'run_after'],
+                         name='imagetask_status_run_after_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.image}: {self.get_status_display()}'
+
+
+class ModelVersion(models.Model):
+    '''Версия данных модели, общая для всех процессов (см. recipes.versions).
+
+    По ней процессы узнают, что кэши и индексы в памяти устарели.
+    '''
+    label = models.CharField(max_length=100, primary_key=True,
+                             verbose_name='Модель')
+    version = models.BigIntegerField(default=0, verbose_name='Версия')
+
+    class Meta:
+        verbose_name = 'Версия данных'
+        verbose_name_plural = 'Версии данных'
+
+    def __str__(self):
+        return f'{self.label}: {self.version}'
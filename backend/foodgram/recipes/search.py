@@ -0,0 +1,81 @@
+from functools import reduce
+from operator import and_, or_
+
+from django.contrib.postgres.aggregates import StringAgg
+from django.contrib.postgres.search import (SearchQuery, SearchRank,
+                                            SearchVector)
+from django.db import connection
+from django.db.models import (Case, Exists, F, IntegerField, OuterRef, Q,
+                              QuerySet, Subquery, TextField, When)
+
+from recipes.models import IngredientAmount, Recipe
+
+SEARCH_CONFIG = 'russian'
+
+
+def is_supported():
+    '''полнотекстовый поиск доступен только на PostgreSQL'''
+    return connection.vendor == 'postgresql'
+
+
+def get_search_vector():
+    '''выражение search_vector: название, текст и названия ингредиентов'''
+    ingredient_names = (
+        IngredientAmount.objects
+        .filter(recipe=OuterRef('pk'))
+        .order_by()
+        .values('recipe')
+        .annotate(names=StringAgg('ingredient__name', ' '))
+        .values('names')
+    )
+    return (
+        SearchVector('name', weight='A', config=SEARCH_CONFIG)
+        + SearchVector('text', weight='B', config=SEARCH_CONFIG)
+        + SearchVector(Subquery(ingredient_names, output_field=TextField()),
+                       weight='C', config=SEARCH_CONFIG)
+    )
+
+
+def update_search_vectors(recipes):
+    '''Пересчитать search_vector рецептов (queryset или список id).
+
+    Обычно векторы поддерживают триггеры базы (миграция
+    0015_search_vector_triggers), функция нужна для полного пересчёта.
+    '''
+    if not is_supported():
+        return
+    if not isinstance(recipes, QuerySet):
+        recipes = Recipe.objects.filter(pk__in=recipes)
+    recipes.update(search_vector=get_search_vector())
+
+
+def search_recipes(queryset, text):
+    '''Отфильтровать рецепты по запросу и упорядочить по релевантности.
+
+    На PostgreSQL используется search_vector с GIN-индексом и русской
+    морфологией. На других базах (SQLite в тестах) каждое слово запроса
+    ищется подстрокой в названии, тексте и ингредиентах.
+    '''
+    if is_supported():
+        query = SearchQuery(text, config=SEARCH_CONFIG,
+                            search_type='websearch')
+        return (queryset
+                .filter(search_vector=query)
+                .annotate(rank=SearchRank(F('search_vector'), query))
+                .order_by('-rank', '-pub_date', '-id'))
+    words = text.split()
+    if not words:
+        return queryset
+    matches = [
+        Q(name__icontains=word)
+        | Q(text__icontains=word)
+        | Exists(IngredientAmount.objects.filter(
+            recipe=OuterRef('pk'), ingredient__name__icontains=word))
+        for word in words
+    ]
+    rank = reduce(or_, [Q(name__icontains=word) for word in words])
+    return (queryset
+            .filter(reduce(and_, matches))
+            .annotate(rank=Case(When(rank, then=1), default=0,
+                                output_field=IntegerField()))
+            .order_by('-rank', '-pub_date', '-id'))
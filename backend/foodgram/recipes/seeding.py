@@ -0,0 +1,187 @@
+import base64
+import io
+import random
+import tempfile
+from contextlib import contextmanager
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.db import connection, transaction
+from django.db.models import Max
+from django.test.utils import override_settings
+from PIL import Image
+
+from recipes import counters, shopping_list
+from recipes.models import Ingredient, IngredientAmount, Recipe, Tag
+from recipes.versions import bump_model_version
+from users.models import Subscription
+
+User = get_user_model()
+
+TAG_NAMES = ('Завтрак', 'Обед', 'Ужин')
+SEED_IMAGE = 'recipes/seed.jpg'
+SEED_PASSWORD = 'seed-password'
+
+LOCAL_CACHE = {
+    'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+}
+
+
+def get_max_pk(model):
+    return model.objects.aggregate(max_pk=Max('pk'))['max_pk'] or 0
+
+
+def created_pks(model, max_pk):
+    return list(model.objects.filter(pk__gt=max_pk).order_by('pk')
+                .values_list('pk', flat=True))
+
+
+def check_options(users=10, recipes_per_user=3, favorites_per_user=5,
+                  carts_per_user=3, subscriptions_per_user=3, **kwargs):
+    '''Проверить, что в данных останутся объекты для get_context.
+
+    Первому пользователю нужны автор, на которого он не подписан,
+    и чужой рецепт не из его избранного и списка покупок. Бросает
+    ValueError с описанием неподходящих параметров.
+    '''
+    if users < 2 or recipes_per_user < 1:
+        raise ValueError('at least 2 users with 1 recipe each are needed')
+    if subscriptions_per_user >= users - 1:
+        raise ValueError(
+            'subscriptions_per_user must be less than users - 1, '
+            'so that a user has an author to subscribe to')
+    if favorites_per_user + carts_per_user >= (users - 1) * recipes_per_user:
+        raise ValueError(
+            'favorites_per_user + carts_per_user must be less than '
+            '(users - 1) * recipes_per_user, so that a user has a recipe '
+            'to add to favorites and the shopping cart')
+
+
+@transaction.atomic
+def seed(users=10, recipes_per_user=3, ingredients=50,
+         ingredients_per_recipe=5, favorites_per_user=5, carts_per_user=3,
+         subscriptions_per_user=3, random_seed=0):
+    '''Заполнить базу связанными данными для проверок и замеров.
+
+    Одинаковые аргументы дают одинаковые данные. Записи создаются
+    через bulk_create, поэтому счётчики, списки покупок и поисковые
+    векторы пересчитываются в конце.
+    '''
+    check_options(users, recipes_per_user, favorites_per_user,
+                  carts_per_user, subscriptions_per_user)
+    rnd = random.Random(random_seed)
+    for name in TAG_NAMES:
+        if not Tag.objects.filter(name=name).exists():
+            Tag.objects.create(name=name)
+    tag_ids = list(Tag.objects.values_list('pk', flat=True))
+
+    max_pk = get_max_pk(Ingredient)
+    Ingredient.objects.bulk_create(
+        Ingredient(name=f'ингредиент {max_pk + n}', measurement_unit='г')
+        for n in range(ingredients))
+    ingredient_ids = created_pks(Ingredient, max_pk)
+
+    max_pk = get_max_pk(User)
+    password = make_password(SEED_PASSWORD)
+    User.objects.bulk_create(
+        User(username=f'user{max_pk + n}',
+             email=f'user{max_pk + n}@example.com',
+             first_name='Имя', last_name='Фамилия', password=password)
+        for n in range(users))
+    user_ids = created_pks(User, max_pk)
+
+    max_pk = get_max_pk(Recipe)
+    Recipe.objects.bulk_create(
+        Recipe(author_id=author_id, name=f'Рецепт {max_pk + n}',
+               text='Описание рецепта', image=SEED_IMAGE,
+               cooking_time=rnd.randint(1, 120))
+        for n, author_id in enumerate(
+            author_id for author_id in user_ids
+            for _ in range(recipes_per_user)))
+    recipe_ids = created_pks(Recipe, max_pk)
+
+    IngredientAmount.objects.bulk_create(
+        IngredientAmount(recipe_id=recipe_id, ingredient_id=ingredient_id,
+                         amount=rnd.randint(1, 500))
+        for recipe_id in recipe_ids
+        for ingredient_id in rnd.sample(
+            ingredient_ids, min(ingredients_per_recipe, len(ingredient_ids))))
+    Recipe.tags.through.objects.bulk_create(
+        Recipe.tags.through(recipe_id=recipe_id, tag_id=tag_id)
+        for recipe_id in recipe_ids
+        for tag_id in rnd.sample(tag_ids, rnd.randint(1, len(tag_ids))))
+
+    for relation, per_user in ((User.favorites, favorites_per_user),
+                               (User.shopping_cart, carts_per_user)):
+        relation.through.objects.bulk_create(
+            relation.through(user_id=user_id, recipe_id=recipe_id)
+            for user_id in user_ids
+            for recipe_id in rnd.sample(
+                recipe_ids, min(per_user, len(recipe_ids))))
+    Subscription.objects.bulk_create(
+        Subscription(subscriber_id=user_id, author_id=author_id)
+        for user_id in user_ids
+        for author_id in rnd.sample(
+            [pk for pk in user_ids if pk != user_id],
+            min(subscriptions_per_user, len(user_ids) - 1)))
+
+    # bulk_create does not send signals
+    bump_model_version(Ingredient)
+    shopping_list.refresh(user_ids)
+    counters.reconcile(fix=True)
+
+
+@contextmanager
+def test_database():
+    '''Временная тестовая база, локальный кэш и временные каталоги
+    медиа и метрик: рабочие данные не затрагиваются'''
+    old_name = connection.settings_dict['NAME']
+    connection.creation.create_test_db(verbosity=0, autoclobber=True)
+    try:
+        with tempfile.TemporaryDirectory() as directory:
+            with override_settings(CACHES=LOCAL_CACHE,
+                                   MEDIA_ROOT=directory,
+                                   METRICS_DIR=directory):
+                yield
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+
+
+def get_image():
+    buffer = io.BytesIO()
+    Image.new('RGB', (8, 8), 'white').save(buffer, 'PNG')
+    return ('data:image/png;base64,'
+            + base64.b64encode(buffer.getvalue()).decode())
+
+
+def get_context():
+    '''Объекты заполненной базы для подстановки в адреса запросов.
+
+    viewer — первый пользователь, recipe — чужой рецепт не из его
+    избранного и списка покупок, author — пользователь, на которого
+    viewer не подписан, own_recipe — рецепт viewer в наибольшем числе
+    корзин, recipe_ids — несколько чужих рецептов.
+    '''
+    viewer = User.objects.order_by('pk').first()
+    recipe = (Recipe.objects.exclude(author=viewer)
+              .exclude(favorited=viewer).exclude(shopped=viewer)
+              .order_by('pk').first())
+    author = (User.objects.exclude(pk=viewer.pk)
+              .exclude(favorite_authors__subscriber=viewer)
+              .order_by('pk').first())
+    own_recipe = (Recipe.objects.filter(author=viewer)
+                  .order_by('-in_carts_count', 'pk').first())
+    return {
+        'viewer': viewer,
+        'password': SEED_PASSWORD,
+        'recipe': recipe.pk,
+        'own_recipe': own_recipe.pk,
+        'recipe_ids': list(Recipe.objects.exclude(author=viewer)
+                           .order_by('pk').values_list('pk', flat=True)[:5]),
+        'author': author.pk,
+        'tag': Tag.objects.order_by('pk').first().slug,
+        'tag_ids': list(Tag.objects.values_list('pk', flat=True)),
+        'ingredient_ids': list(Ingredient.objects.order_by('pk')
+                               .values_list('pk', flat=True)[:10]),
+        'image': get_image(),
+    }
@@ -0,0 +1,72 @@
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.db.models import Sum
+
+from recipes.models import IngredientAmount, ShoppingListItem
+
+User = get_user_model()
+
+
+def get_changes(user_ids, ingredient_ids=None):
+    '''Расхождения агрегата с корзинами пользователей.
+
+    Возвращает позиции для создания, обновления и удаления. Если передан
+    ingredient_ids, сравниваются только эти ингредиенты.
+    '''
+    totals = IngredientAmount.objects.filter(recipe__shopped__in=user_ids)
+    items = ShoppingListItem.objects.filter(user__in=user_ids)
+    if ingredient_ids is not None:
+        totals = totals.filter(ingredient__in=ingredient_ids)
+        items = items.filter(ingredient__in=ingredient_ids)
+    totals = {
+        (row['recipe__shopped'], row['ingredient']): row['total']
+        for row in totals.values('recipe__shopped', 'ingredient')
+        .annotate(total=Sum('amount')).order_by()
+    }
+    to_update, to_delete = [], []
+    for item in items:
+        total = totals.pop((item.user_id, item.ingredient_id), None)
+        if total is None:
+            to_delete.append(item)
+        elif total != item.amount:
+            item.amount = total
+            to_update.append(item)
+    to_create = [
+        ShoppingListItem(user_id=user_id, ingredient_id=ingredient_id,
+                         amount=total)
+        for (user_id, ingredient_id), total in totals.items()
+    ]
+    return to_create, to_update, to_delete
+
+
+def refresh(user_ids, ingredient_ids=None):
+    '''Пересчитать списки покупок пользователей по их корзинам.
+
+    Строки пользователей блокируются до конца транзакции, поэтому
+    одновременные изменения корзины одного пользователя применяются
+    по очереди и каждое видит результат предыдущего.
+    '''
+    with transaction.atomic():
+        list(User.objects.select_for_update()
+             .filter(pk__in=user_ids).order_by('pk').values_list('pk'))
+        to_create, to_update, to_delete = get_changes(
+            user_ids, ingredient_ids)
+        ShoppingListItem.objects.bulk_create(to_create)
+        ShoppingListItem.objects.bulk_update(to_update, ['amount'])
+        ShoppingListItem.objects.filter(
+            pk__in=[item.pk for item in to_delete]).delete()
+
+
+def refresh_carts(user_ids, recipe_ids):
+    '''Корзины пользователей изменились на рецепты recipe_ids.'''
+    refresh(user_ids, IngredientAmount.objects.filter(
+        recipe__in=recipe_ids).values('ingredient'))
+
+
+def refresh_recipe(recipe, ingredient_ids):
+    '''В рецепте (объект или id) изменились количества ингредиентов
+    ingredient_ids.'''
+    user_ids = list(User.objects.filter(
+        shopping_cart=recipe).values_list('pk', flat=True))
+    if user_ids:
+        refresh(user_ids, ingredient_ids)
@@ -0,0 +1,214 @@
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.db import transaction
+from django.db.models.signals import (m2m_changed, post_delete, post_save,
+                                      pre_delete, pre_save)
+from django.dispatch import receiver
+
+from recipes import shopping_list
+from recipes.autocomplete import ingredient_index
+from recipes.models import Ingredient, IngredientAmount, Recipe, Tag, User
+from recipes.utils import increment_counter
+from recipes.versions import bump_model_version
+
+# рецепты, чей состав сейчас меняется целиком: версию и списки покупок
+# обновит вызывающий код один раз, а не сигналы по каждой строке
+handled_recipes = ContextVar('handled_recipes', default=frozenset())
+
+
+@contextmanager
+def amounts_handled(recipe_ids):
+    '''Не обрабатывать сигналы IngredientAmount этих рецептов.'''
+    token = handled_recipes.set(handled_recipes.get() | set(recipe_ids))
+    try:
+        yield
+    finally:
+        handled_recipes.reset(token)
+
+
+@transaction.atomic
+def delete_recipes(recipes):
+    '''Удалить рецепты queryset с пересчётом списков покупок за один раз.
+
+    Сигналы отдельных рецептов и их ингредиентов пропускаются, поэтому
+    число запросов не зависит от числа рецептов.
+    '''
+    recipes = list(recipes.values_list('pk', 'author'))
+    recipe_ids = [pk for pk, _ in recipes]
+    shoppers = list(User.objects.filter(
+        shopping_cart__in=recipe_ids).values_list('pk', flat=True).distinct())
+    ingredient_ids = list(IngredientAmount.objects.filter(
+        recipe__in=recipe_ids).values_list('ingredient', flat=True).distinct())
+    with amounts_handled(recipe_ids):
+        Recipe.objects.filter(pk__in=recipe_ids).delete()
+    for author_id, count in Counter(
+            author_id for _, author_id in recipes).items():
+        increment_counter(User.objects.filter(pk=author_id),
+                          'recipes_count', -count)
+    if shoppers:
+        shopping_list.refresh(shoppers, ingredient_ids)
+
+
+@receiver(post_save, sender=Ingredient)
+@receiver(post_delete, sender=Ingredient)
+def ingredient_changed(sender, **kwargs):
+    bump_model_version(Ingredient)
+    # в этом процессе изменение видно сразу, а не через CHECK_INTERVAL
+    transaction.on_commit(ingredient_index.expire)
+
+
+@receiver(post_save, sender=Tag)
+@receiver(post_delete, sender=Tag)
+def tag_changed(sender, **kwargs):
+    bump_model_version(Tag)
+
+
+def normalize_m2m_action(sender, instance, action, reverse, pk_set):
+    '''Свести clear к remove для списков избранного и корзины.
+
+    Возвращает (action, pk_set) или (None, None), если обрабатывать
+    изменение не нужно.
+    '''
+    if action == 'pre_clear':
+        if reverse:
+            pks = sender.objects.filter(recipe=instance).values_list(
+                'user', flat=True)
+        else:
+            pks = sender.objects.filter(user=instance).values_list(
+                'recipe', flat=True)
+        instance._cleared_pks = set(pks)
+        return None, None
+    if action == 'post_clear':
+        return 'post_remove', instance.__dict__.pop('_cleared_pks')
+    if action in ('post_add', 'post_remove') and pk_set:
+        return action, pk_set
+    return None, None
+
+
+def update_recipe_counter(field, instance, action, reverse, pk_set):
+    delta = 1 if action == 'post_add' else -1
+    if reverse:
+        increment_counter(Recipe.objects.filter(pk=instance.pk), field,
+                          delta * len(pk_set))
+    else:
+        increment_counter(Recipe.objects.filter(pk__in=pk_set), field, delta)
+
+
+@receiver(m2m_changed, sender=User.favorites.through)
+def favorites_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    action, pk_set = normalize_m2m_action(
+        sender, instance, action, reverse, pk_set)
+    if action:
+        update_recipe_counter(
+            'favorites_count', instance, action, reverse, pk_set)
+
+
+@receiver(m2m_changed, sender=User.shopping_cart.through)
+def shopping_cart_changed(sender, instance, action, reverse, pk_set,
+                          **kwargs):
+    action, pk_set = normalize_m2m_action(
+        sender, instance, action, reverse, pk_set)
+    if not action:
+        return
+    update_recipe_counter(
+        'in_carts_count', instance, action, reverse, pk_set)
+    if reverse:
+        shopping_list.refresh_carts(pk_set, [instance.pk])
+    else:
+        shopping_list.refresh_carts([instance.pk], pk_set)
+
+
+@receiver(m2m_changed, sender=Recipe.tags.through)
+def recipe_tags_changed(sender, instance, action, reverse, pk_set,
+                        **kwargs):
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    if not reverse:
+        Recipe.objects.filter(pk=instance.pk).touch()
+    elif pk_set:
+        Recipe.objects.filter(pk__in=pk_set).touch()
+    else:
+        # рецепты, у которых сняли тег, уже неизвестны
+        bump_model_version(Tag)
+
+
+@receiver(post_save, sender=User)
+def author_saved(sender, instance, created, update_fields, **kwargs):
+    if created or update_fields == frozenset({'last_login'}):
+        return
+    Recipe.objects.filter(author=instance).touch()
+
+
+@receiver(pre_delete, sender=User)
+def user_deleting(sender, instance, **kwargs):
+    '''строки избранного и корзины удаляются каскадом без m2m_changed'''
+    increment_counter(Recipe.objects.filter(favorited=instance),
+                      'favorites_count', -1)
+    increment_counter(Recipe.objects.filter(shopped=instance),
+                      'in_carts_count', -1)
+
+
+@receiver(post_save, sender=Recipe)
+def recipe_saved(sender, instance, created, **kwargs):
+    if created:
+        increment_counter(User.objects.filter(pk=instance.author_id),
+                          'recipes_count', 1)
+
+
+@receiver(pre_delete, sender=Recipe)
+def recipe_deleting(sender, instance, **kwargs):
+    '''Запомнить покупателей и ингредиенты удаляемого рецепта.
+
+    Его строки IngredientAmount удаляются каскадом до самого рецепта,
+    списки покупок обновит recipe_deleted одним пересчётом.
+    '''
+    if instance.pk in handled_recipes.get():
+        # удаление через delete_recipes
+        return
+    instance._shoppers = list(instance.shopped.values_list('pk', flat=True))
+    instance._ingredient_ids = list(
+        instance.amounts.values_list('ingredient', flat=True))
+    handled_recipes.set(handled_recipes.get() | {instance.pk})
+
+
+@receiver(post_delete, sender=Recipe)
+def recipe_deleted(sender, instance, **kwargs):
+    if '_shoppers' not in instance.__dict__:
+        return
+    handled_recipes.set(handled_recipes.get() - {instance.pk})
+    increment_counter(User.objects.filter(pk=instance.author_id),
+                      'recipes_count', -1)
+    if instance._shoppers:
+        shopping_list.refresh(instance._shoppers, instance._ingredient_ids)
+
+
+@receiver(pre_save, sender=IngredientAmount)
+def ingredient_amount_saving(sender, instance, **kwargs):
+    '''запомнить прежние рецепт и ингредиент: их тоже нужно обновить'''
+    if instance.recipe_id in handled_recipes.get():
+        return
+    instance._previous = sender.objects.filter(pk=instance.pk).values_list(
+        'recipe', 'ingredient').first() if instance.pk else None
+
+
+@receiver(post_save, sender=IngredientAmount)
+def ingredient_amount_saved(sender, instance, **kwargs):
+    '''сменить версию рецепта и обновить списки покупок'''
+    if instance.recipe_id in handled_recipes.get():
+        return
+    changed = {(instance.recipe_id, instance.ingredient_id),
+               instance.__dict__.pop('_previous', None)} - {None}
+    Recipe.objects.filter(
+        pk__in={recipe_id for recipe_id, _ in changed}).touch()
+    for recipe_id, ingredient_id in changed:
+        shopping_list.refresh_recipe(recipe_id, [ingredient_id])
+
+
+@receiver(post_delete, sender=IngredientAmount)
+def ingredient_amount_deleted(sender, instance, **kwargs):
+    if instance.recipe_id in handled_recipes.get():
+        return
+    Recipe.objects.filter(pk=instance.recipe_id).touch()
+    shopping_list.refresh_recipe(instance.recipe_id, [instance.ingredient_id])
@@ -0,0 +1,91 @@
+from datetime import timedelta
+
+from django.db import transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from recipes.images import delete_image, variants_exist
+from recipes.models import ImageStatus, ImageTask, Recipe
+
+MAX_ATTEMPTS = 5
+RETRY_DELAY = timedelta(seconds=30)
+# Задачи в обработке дольше этого срока считаются брошенными.
+STALE_AFTER = timedelta(minutes=10)
+
+
+def get_image_status(name):
+    '''начальное состояние картинки сразу после загрузки'''
+    if variants_exist(name):
+        return ImageStatus.READY
+    return ImageStatus.PENDING
+
+
+def delete_unused_image(name):
+    '''удалить картинку и производные, если ни один рецепт на неё не
+    ссылается (одинаковые картинки хранятся один раз)'''
+    if name and not Recipe.objects.filter(image=name).exists():
+        delete_image(name)
+
+
+def enqueue_image(name):
+    ImageTask.objects.bulk_create([ImageTask(image=name)],
+                                  ignore_conflicts=True)
+    ImageTask.objects.filter(image=name).exclude(
+        status__in=[ImageTask.Status.PENDING, ImageTask.Status.PROCESSING]
+    ).update(status=ImageTask.Status.PENDING, attempts=0, error='',
+             run_after=timezone.now())
+
+
+def claim_tasks(limit):
+    '''Взять в работу до limit готовых к выполнению задач.
+
+    На PostgreSQL несколько обработчиков не мешают друг другу благодаря
+    SELECT ... FOR UPDATE SKIP LOCKED.
+    '''
+    now = timezone.now()
+    with transaction.atomic():
+        tasks = list(
+            ImageTask.objects
+            .select_for_update(skip_locked=True)
+            .filter(
+                Q(status=ImageTask.Status.PENDING, run_after__lte=now)
+                | Q(status=ImageTask.Status.PROCESSING,
+                    updated__lte=now - STALE_AFTER)
+            )
+            .order_by('run_after')[:limit]
+        )
+        ImageTask.objects.filter(pk__in=[task.pk for task in tasks]).update(
+            status=ImageTask.Status.PROCESSING,
+            attempts=F('attempts') + 1,
+            updated=now,
+        )
+    for task in tasks:
+        task.attempts += 1
+    return tasks
+
+
+def complete_task(task):
+    with transaction.atomic():
+        ImageTask.objects.filter(pk=task.pk).update(
+            status=ImageTask.Status.DONE, error='', updated=timezone.now())
+        Recipe.objects.filter(image=task.image).touch(
+            image_status=ImageStatus.READY)
+
+
+def fail_task(task, error):
+    '''Вернуть задачу в очередь с задержкой или отметить как ошибочную.
+
+    Возвращает True, если попытки исчерпаны.
+    '''
+    now = timezone.now()
+    if task.attempts < MAX_ATTEMPTS:
+        ImageTask.objects.filter(pk=task.pk).update(
+            status=ImageTask.Status.PENDING, error=error, updated=now,
+            run_after=now + RETRY_DELAY * 2 ** (task.attempts - 1))
+        return False
+    with transaction.atomic():
+        ImageTask.objects.filter(pk=task.pk).update(
+            status=ImageTask.Status.FAILED, error=error, updated=now)
+        Recipe.objects.filter(image=task.image).touch(
+            image_status=ImageStatus.FAILED)
+    return True
@@ -0,0 +1,44 @@
+from django.test import TestCase
+
+from recipes.autocomplete import IngredientIndex
+from recipes.models import Ingredient
+
+NAMES = ('Соль', 'соль морская', 'Перец чёрный', 'Сахар', 'Сахарная пудра',
+         'Масло сливочное', 'Кокосовое масло', 'Яйцо', 'Лук')
+
+
+class IngredientIndexTest(TestCase):
+    '''Поиск по индексу совпадает с перебором всех названий.'''
+
+    @classmethod
+    def setUpTestData(cls):
+        Ingredient.objects.bulk_create(
+            Ingredient(name=name, measurement_unit='г') for name in NAMES)
+
+    def expected(self, query):
+        query = query.casefold()
+        names = sorted(NAMES, key=str.casefold)
+        return ([name for name in names if name.casefold().startswith(query)]
+                + [name for name in names if query in name.casefold()
+                   and not name.casefold().startswith(query)])
+
+    def test_search(self):
+        index = IngredientIndex()
+        for query in ('с', 'СО', 'соль', 'ль', 'асл', 'масло', 'сло сли',
+                      'ахарн', 'о', 'нет', 'солька'):
+            with self.subTest(query):
+                self.assertEqual(
+                    [entry['name'] for entry in index.search(query)],
+                    self.expected(query))
+
+    def test_version_checked_once(self):
+        index = IngredientIndex()
+        index.search('с')
+        with self.assertNumQueries(0):
+            index.search('соль')
+        with self.captureOnCommitCallbacks(execute=True):
+            Ingredient.objects.create(name='Сельдерей', measurement_unit='г')
+        self.assertEqual(index.search('сельд'), [])
+        index.expire()
+        self.assertEqual(
+            [entry['name'] for entry in index.search('сельд')], ['Сельдерей'])
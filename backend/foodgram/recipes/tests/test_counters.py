@@ -0,0 +1,47 @@
+from django.test import TestCase
+
+from recipes import counters, seeding
+from recipes.models import Recipe
+from recipes.signals import delete_recipes
+from users.models import Subscription, User
+from users.signals import subscriptions_handled
+
+
+class CountersTest(TestCase):
+    '''Денормализованные счётчики совпадают с данными.'''
+
+    @classmethod
+    def setUpTestData(cls):
+        seeding.seed(users=6, recipes_per_user=2, ingredients=10,
+                     favorites_per_user=4, carts_per_user=3,
+                     subscriptions_per_user=3)
+
+    def assert_no_drift(self):
+        drift = counters.reconcile(fix=False)
+        self.assertEqual(drift, dict.fromkeys(drift, 0))
+
+    def test_user_delete(self):
+        user = User.objects.filter(favorites__isnull=False,
+                                   shopping_cart__isnull=False).first()
+        user.delete()
+        self.assert_no_drift()
+
+    def test_bulk_user_delete(self):
+        '''как в UserViewSet.perform_destroy'''
+        user = User.objects.filter(subscribers_count__gt=0,
+                                   subsribers__isnull=False).first()
+        delete_recipes(user.recipes.all())
+        with subscriptions_handled(user):
+            user.delete()
+        self.assert_no_drift()
+
+    def test_stale_save_keeps_counters(self):
+        author = User.objects.filter(subscribers_count__gt=0).first()
+        recipe = Recipe.objects.filter(favorites_count__gt=0).first()
+        Subscription.objects.filter(author=author).first().delete()
+        recipe.favorited.remove(recipe.favorited.first())
+        author.first_name = 'Другое'
+        author.save()
+        recipe.name = 'Другое'
+        recipe.save()
+        self.assert_no_drift()
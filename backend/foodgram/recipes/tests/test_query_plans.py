@@ -0,0 +1,70 @@
+from unittest import skipUnless
+
+from django.db import connection, transaction
+from django.db.models import Exists, OuterRef
+from django.test import TestCase
+
+from recipes.models import Recipe
+from users.models import Subscription, User
+
+USER_ID = 0
+
+
+def get_index(table, columns):
+    '''имя индекса или уникального ограничения по столбцам'''
+    with connection.cursor() as cursor:
+        constraints = connection.introspection.get_constraints(cursor, table)
+    return next(name for name, info in constraints.items()
+                if (info['index'] or info['unique'])
+                and info['columns'] == columns)
+
+
+def get_checks():
+    '''(описание, запрос, таблица и столбцы индекса, который должен
+    использоваться)'''
+    favorited = Exists(User.favorites.through.objects.filter(
+        user_id=USER_ID, recipe=OuterRef('pk')))
+    shopped = Exists(User.shopping_cart.through.objects.filter(
+        user_id=USER_ID, recipe=OuterRef('pk')))
+    return [
+        ('is_favorited=1', Recipe.objects.filter(favorited),
+         'users_user_favorites', ['user_id', 'recipe_id']),
+        ('is_favorited=0', Recipe.objects.filter(~favorited),
+         'users_user_favorites', ['user_id', 'recipe_id']),
+        ('is_in_shopping_cart=1', Recipe.objects.filter(shopped),
+         'users_user_shopping_cart', ['user_id', 'recipe_id']),
+        ('is_in_shopping_cart=0', Recipe.objects.filter(~shopped),
+         'users_user_shopping_cart', ['user_id', 'recipe_id']),
+        ('subscriptions',
+         Subscription.objects.filter(subscriber_id=USER_ID)
+         .order_by('author__username'),
+         'users_subscription', ['subscriber_id', 'author_id']),
+        ('subscribers',
+         Subscription.objects.filter(author_id=USER_ID),
+         'users_subscription', ['author_id']),
+        ('author feed',
+         Recipe.objects.filter(author_id=USER_ID)
+         .order_by('-pub_date', '-id')[:10],
+         'recipes_recipe', ['author_id', 'pub_date', 'id']),
+    ]
+
+
+@skipUnless(connection.vendor == 'postgresql',
+            'query plans are checked on PostgreSQL only')
+class QueryPlansTest(TestCase):
+    '''Горячие запросы читают таблицы по ожидаемым индексам.'''
+
+    def test_hot_paths_use_indexes(self):
+        for label, queryset, table, columns in get_checks():
+            index = get_index(table, columns)
+            with self.subTest(label, index=index):
+                plan = self.explain(queryset)
+                self.assertIn(index, plan)
+                self.assertNotIn(f'Seq Scan on {table}', plan)
+
+    def explain(self, queryset):
+        # on small tables the planner prefers sequential scans, so they
+        # are disabled to find out whether the index is usable at all
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.execute('SET LOCAL enable_seqscan = off')
+            return queryset.explain()
@@ -0,0 +1,112 @@
+from django.contrib.auth import get_user_model
+from django.db import IntegrityError, transaction
+
+from recipes import shopping_list
+from recipes.models import Recipe
+from recipes.utils import increment_counter
+
+User = get_user_model()
+
+FAVORITES = 'favorites'
+SHOPPING_CART = 'shopping_cart'
+COUNTERS = {
+    FAVORITES: 'favorites_count',
+    SHOPPING_CART: 'in_carts_count',
+}
+
+
+def get_through(relation):
+    return getattr(User, relation).through
+
+
+def lists_changed(relation, user, recipe_ids, delta):
+    '''Обновить счётчики рецептов и список покупок после изменения.
+
+    Строки m2m-таблицы меняются напрямую, без сигналов m2m_changed,
+    поэтому зависящие от них данные пересчитываются здесь.
+    '''
+    increment_counter(Recipe.objects.filter(pk__in=recipe_ids),
+                      COUNTERS[relation], delta)
+    if relation == SHOPPING_CART:
+        shopping_list.refresh_carts([user.pk], recipe_ids)
+
+
+def lock_recipes(recipe_ids):
+    '''Заблокировать рецепты по возрастанию id.
+
+    Все изменения списков сначала блокируют рецепты, потом меняют
+    строки m2m-таблицы и счётчики, и только пересчёт списка покупок
+    блокирует пользователя. Правка рецепта идёт в том же порядке:
+    строка рецепта, затем его покупатели. Поэтому одновременные
+    изменения не ждут друг друга по кругу, а проверка «уже в списке»
+    видит все завершённые изменения этих рецептов.
+    '''
+    list(Recipe.objects.select_for_update().filter(
+        pk__in=recipe_ids).order_by('pk').values_list('pk'))
+
+
+@transaction.atomic
+def add(relation, user, recipe):
+    '''Добавить рецепт в избранное или корзину одним INSERT.
+
+    Возвращает False, если рецепт уже был в списке: повторная вставка
+    отклоняется уникальным ограничением, а не предварительной проверкой.
+    '''
+    lock_recipes([recipe.pk])
+    try:
+        with transaction.atomic():
+            get_through(relation).objects.create(user=user, recipe=recipe)
+    except IntegrityError:
+        return False
+    lists_changed(relation, user, [recipe.pk], 1)
+    return True
+
+
+@transaction.atomic
+def remove(relation, user, recipe):
+    '''Удалить рецепт из избранного или корзины одним DELETE.
+
+    Возвращает False, если рецепта в списке не было.
+    '''
+    lock_recipes([recipe.pk])
+    deleted, _ = get_through(relation).objects.filter(
+        user=user, recipe=recipe).delete()
+    if not deleted:
+        return False
+    lists_changed(relation, user, [recipe.pk], -1)
+    return True
+
+
+@transaction.atomic
+def add_many(relation, user, recipe_ids):
+    '''Добавить рецепты в избранное или корзину одним INSERT.
+
+    Возвращает множества (добавленные, уже бывшие в списке) id рецептов.
+    '''
+    lock_recipes(recipe_ids)
+    through = get_through(relation)
+    existing = set(through.objects.filter(
+        user=user, recipe__in=recipe_ids).values_list('recipe', flat=True))
+    added = set(recipe_ids) - existing
+    through.objects.bulk_create(
+        [through(user=user, recipe_id=pk) for pk in added],
+        ignore_conflicts=True)
+    if added:
+        lists_changed(relation, user, added, 1)
+    return added, existing
+
+
+@transaction.atomic
+def remove_many(relation, user, recipe_ids):
+    '''Удалить рецепты из избранного или корзины одним DELETE.
+
+    Возвращает множество удалённых id рецептов.
+    '''
+    lock_recipes(recipe_ids)
+    through = get_through(relation)
+    rows = through.objects.filter(user=user, recipe__in=recipe_ids)
+    removed = set(rows.values_list('recipe', flat=True))
+    if removed:
+        rows.delete()
+        lists_changed(relation, user, removed, -1)
+    return removed
@@ -1,6 +1,26 @@
+from django.db.models import F
+from django.db.models.functions import Greatest
+
+
 def transliterate(any_string: str) -> str:
     '''перевод строки из кириллицы в латиницу'''
     return any_string.translate(str.maketrans(
         "абвгдеёжзийклмнопрстуфхцчшщъыьэюяАБВГДЕЁЖЗИЙКЛМНОПРСТУФХЦЧШЩЪЫЬЭЮЯ",
         "abvgdeejzijklmnoprstufhzcss_y_euaABVGDEEJZIJKLMNOPRSTUFHZCSS_Y_EUA"
     ))
+
+
+def increment_counter(queryset, field: str, delta: int) -> None:
+    '''атомарно изменить счётчик в строках queryset, не опуская ниже нуля'''
+    queryset.update(**{field: Greatest(F(field) + delta, 0)})
+
+
+def get_update_fields(instance, excluded) -> set:
+    '''Поля для полного сохранения существующей строки.
+
+    Кроме excluded пропускаются отложенные поля: как и Model.save(),
+    сохраняются только загруженные значения.
+    '''
+    return ({field.attname for field in instance._meta.concrete_fields
+             if not field.primary_key}
+            - set(excluded) - instance.get_deferred_fields())
@@ -0,0 +1,47 @@
+import time
+
+from django.db.models import F, Value
+from django.db.models.functions import Greatest
+
+from recipes.models import ModelVersion
+
+
+def get_label(model) -> str:
+    return model._meta.label_lower
+
+
+def get_model_versions(*models) -> list:
+    '''текущие версии данных моделей одним запросом'''
+    labels = [get_label(model) for model in models]
+    versions = dict(ModelVersion.objects.filter(
+        label__in=labels).values_list('label', 'version'))
+    missing = [label for label in labels if label not in versions]
+    if missing:
+        ModelVersion.objects.bulk_create(
+            [ModelVersion(label=label, version=time.time_ns())
+             for label in missing],
+            ignore_conflicts=True)
+        versions.update(ModelVersion.objects.filter(
+            label__in=missing).values_list('label', 'version'))
+    return [versions[label] for label in labels]
+
+
+def get_model_version(model) -> int:
+    '''текущая версия данных модели, меняется при каждом изменении'''
+    return get_model_versions(model)[0]
+
+
+def bump_model_version(model) -> None:
+    '''Отметить изменение данных модели.
+
+    Версия хранится в базе, поэтому изменение видят все процессы, а при
+    откате транзакции откатывается и оно. Версия только растёт.
+    '''
+    label = get_label(model)
+    version = time.time_ns()
+    updated = ModelVersion.objects.filter(label=label).update(
+        version=Greatest(F('version') + 1, Value(version)))
+    if not updated:
+        ModelVersion.objects.bulk_create(
+            [ModelVersion(label=label, version=version)],
+            ignore_conflicts=True)
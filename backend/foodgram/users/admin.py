@@ -28,7 +28,8 @@ class StaffRequired(object):
 
 
 class UserAdmin(StaffRequired, admin.ModelAdmin):
-    list_display = ('username', 'email')
+    list_display = ('username', 'email', 'recipes_count',
+                    'subscribers_count')
     search_fields = ('username', 'email')
     filter_horizontal = ('favorites', 'shopping_cart')
     fields = (
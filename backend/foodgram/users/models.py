@@ -2,6 +2,8 @@ from django.contrib.auth.models import AbstractUser
 from django.core.exceptions import ValidationError
 from django.db import models
 
+from recipes.utils import get_update_fields
+
 
 class User(AbstractUser):
     favorites = models.ManyToManyField(
@@ -17,6 +19,13 @@ class User(AbstractUser):
                                  verbose_name='last name')
     password = models.CharField(blank=False, max_length=150,
                                 verbose_name='password')
+    recipes_count = models.PositiveIntegerField(
+        default=0, editable=False, verbose_name='Число рецептов')
+    subscribers_count = models.PositiveIntegerField(
+        default=0, editable=False, verbose_name='Число подписчиков')
+
+    # меняются только атомарно через F(), см. recipes.utils.increment_counter
+    COUNTER_FIELDS = ('recipes_count', 'subscribers_count')
 
     USERNAME_FIELD = 'email'
     REQUIRED_FIELDS = [
@@ -27,6 +36,25 @@ class User(AbstractUser):
         verbose_name_plural = 'Пользователи'
         ordering = ['email']
 
+    def save(self, *args, **kwargs):
+        '''Сохранить пользователя, не трогая счётчики.
+
+        Полное сохранение загруженного ранее объекта иначе записало бы
+        устаревшие значения поверх изменений через F().
+        '''
+        if not self._state.adding and kwargs.get('update_fields') is None:
+            kwargs['update_fields'] = get_update_fields(
+                self, self.COUNTER_FIELDS)
+        super().save(*args, **kwargs)
+
+    def refresh_from_db(self, using=None, fields=None):
+        '''Первое обращение к отложенному полю загружает все отложенные
+        поля одним запросом, а не по запросу на поле.'''
+        deferred = self.get_deferred_fields()
+        if fields is not None and deferred.issuperset(fields):
+            fields = deferred
+        super().refresh_from_db(using, fields)
+
 
 class Subscription(models.Model):
     subscriber = models.ForeignKey(User, related_name='subsribers',
@@ -0,0 +1,44 @@
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from recipes.utils import increment_counter
+from users.models import Subscription, User
+
+# удаляемые пользователи: счётчики подписчиков уже уменьшены заранее,
+# каскадное удаление их подписок сигналы пропускают
+handled_users = ContextVar('handled_users', default=frozenset())
+
+
+@contextmanager
+def subscriptions_handled(user):
+    '''Уменьшить счётчики авторов, на которых подписан user, одним запросом.
+
+    Внутри блока сигналы удаления подписок user и на user не
+    обрабатываются, число запросов не зависит от числа подписок.
+    Вызывающий код отвечает за транзакцию.
+    '''
+    increment_counter(User.objects.filter(favorite_authors__subscriber=user),
+                      'subscribers_count', -1)
+    token = handled_users.set(handled_users.get() | {user.pk})
+    try:
+        yield
+    finally:
+        handled_users.reset(token)
+
+
+@receiver(post_save, sender=Subscription)
+def subscription_saved(sender, instance, created, **kwargs):
+    if created:
+        increment_counter(User.objects.filter(pk=instance.author_id),
+                          'subscribers_count', 1)
+
+
+@receiver(post_delete, sender=Subscription)
+def subscription_deleted(sender, instance, **kwargs):
+    if {instance.subscriber_id, instance.author_id} & handled_users.get():
+        return
+    increment_counter(User.objects.filter(pk=instance.author_id),
+                      'subscribers_count', -1)